@@ -1,3 +1,5 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -5,20 +7,27 @@ import gym
 import imageio
 import numpy as np
 
-from PIL import Image
-
 
 class SaveNpzWrapper(gym.Wrapper):
+    """Saves each finished episode as NPZ (and video) in log_dir.
+
+    Compression and video encoding run in a pool of background threads (both release the GIL),
+    so they don't stall stepping. At most max_pending episodes are queued or being written;
+    beyond that step() blocks until a write finishes. close() waits for all writes.
+    """
 
-    def __init__(self, env, log_dir, video_fps=30, video_size=256, video_format='mp4'):
+    def __init__(self, env, log_dir, video_fps=30, video_size=256, video_format='mp4', chunk_size=1001, chunk_dir=None, workers=1, max_pending=2):
         env = ActionRewardResetWrapper(env)
-        env = CollectWrapper(env)
+        env = CollectWrapper(env, chunk_size, chunk_dir)
         super().__init__(env)
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(parents=True, exist_ok=True)
         self.video_fps = video_fps
         self.video_size = video_size
         self.video_format = video_format
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='SaveNpzWrapper')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = []
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)  # type: ignore
@@ -28,50 +37,145 @@ class SaveNpzWrapper(gym.Wrapper):
             ep_reward = data['reward'].sum()
             ep_steps = len(data['reward']) - 1
             ep_name = f'{ep_id}-r{ep_reward:.0f}-{ep_steps:04}'
-            self._save_npz(data, self.log_dir / f'{ep_name}.npz')
-            if self.video_format:
-                self._save_video(data, self.log_dir / f'{ep_name}.{self.video_format}')
+            self._submit(data, ep_name)
         return obs, reward, done, info
 
+    def close(self):
+        futures, self._futures = self._futures, []
+        try:
+            errors = [e for e in (future.exception() for future in futures) if e is not None]  # Waits for all writes
+            if errors:
+                raise errors[0]
+        finally:
+            self._executor.shutdown(wait=True)
+            self.env.close()
+
+    def _submit(self, data, ep_name):
+        for future in [f for f in self._futures if f.done()]:
+            future.result()
+            self._futures.remove(future)
+        self._pending.acquire()  # Backpressure
+        future = self._executor.submit(self._save, data, ep_name)
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append(future)
+
+    def _save(self, data, ep_name):
+        self._save_npz(data, self.log_dir / f'{ep_name}.npz')
+        if self.video_format:
+            self._save_video(data, self.log_dir / f'{ep_name}.{self.video_format}')
+
     def _save_npz(self, data, path):
         with path.open('wb') as f:
             np.savez_compressed(f, **data)
         print(f'Saved {path}', {k: v.shape for k, v in data.items()})
-    
+
     def _save_video(self, data, path):
+        frames = data['image']
+        rows = _nearest_indices(frames.shape[1], self.video_size)
+        cols = _nearest_indices(frames.shape[2], self.video_size)
         writer = imageio.get_writer(path, fps=self.video_fps)
-        for frame in data['image']:
-            img = Image.fromarray(frame)
-            img = img.resize((self.video_size, self.video_size), resample=0)
-            writer.append_data(np.array(img))
+        for frame in frames:
+            writer.append_data(frame[rows[:, None], cols])
         writer.close()
         print(f'Saved {path}')
 
 
+def _nearest_indices(size_in, size_out):
+    """Source pixel of each output pixel, as in PIL resize(resample=NEAREST)."""
+    scale = size_in / size_out
+    indices = []
+    x = scale * 0.5
+    for _ in range(size_out):
+        indices.append(int(x))
+        x += scale  # Accumulated, as in PIL
+    return np.array(indices)
+
+
 class CollectWrapper(gym.Wrapper):
-    """Copied from pydreamer.envs.wrappers."""
+    """Adapted from pydreamer.envs.wrappers.
+
+    Records observations into per-key arrays, preallocated for chunk_size steps at a time
+    from the shapes and dtypes of the reset observation. Set chunk_size to the episode length
+    (time limit * control frequency + 1 for the reset observation) to have a single chunk.
+
+    If chunk_dir is set, each full chunk is appended to a file on disk and the buffers are
+    reused, so memory doesn't grow with episode length, and info['episode'] contains
+    memory-mapped arrays. Files of an episode are deleted on the next reset.
+    """
 
-    def __init__(self, env):
+    def __init__(self, env, chunk_size=1001, chunk_dir=None):
         super().__init__(env)
         self.env = env
-        self.episode = []
+        self.chunk_size = chunk_size
+        self.chunk_dir = Path(chunk_dir) if chunk_dir else None
         self.episode_id = ''
+        self._buffers = {}
+        self._chunks = []  # Full chunks, kept in memory if not chunk_dir
+        self._files = {}  # key => path of the chunk file, if chunk_dir
+        self._n = 0  # Steps in current chunk
+        self._steps = 0  # Steps in episode
+        if self.chunk_dir:
+            self.chunk_dir.mkdir(parents=True, exist_ok=True)
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
-        self.episode.append(obs.copy())
+        self._add(obs)
         if done:
-            episode = {k: np.array([t[k] for t in self.episode]) for k in self.episode[0]}
-            info['episode'] = episode
+            info['episode'] = self._finish()
         info['episode_id'] = self.episode_id
         return obs, reward, done, info
 
     def reset(self):
         obs = self.env.reset()
-        self.episode = [obs.copy()]
         self.episode_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self._delete_files()
+        self._buffers = {k: np.empty((self.chunk_size,) + np.shape(v), np.asarray(v).dtype) for k, v in obs.items()}
+        self._chunks = []
+        if self.chunk_dir:
+            self._files = {k: self.chunk_dir / f'{self.episode_id}-{k.replace("/", "_")}.bin' for k in obs}
+            for path in self._files.values():
+                path.write_bytes(b'')
+        self._n = 0
+        self._steps = 0
+        self._add(obs)
         return obs
 
+    def close(self):
+        self._delete_files()
+        return self.env.close()
+
+    def _add(self, obs):
+        if self._n == self.chunk_size:
+            self._flush()
+        for k, buffer in self._buffers.items():
+            buffer[self._n] = obs[k]
+        self._n += 1
+        self._steps += 1
+
+    def _flush(self):
+        if self.chunk_dir:
+            for k, buffer in self._buffers.items():
+                with self._files[k].open('ab') as f:
+                    buffer[:self._n].tofile(f)
+        else:
+            self._chunks.append(self._buffers)
+            self._buffers = {k: np.empty_like(buffer) for k, buffer in self._buffers.items()}
+        self._n = 0
+
+    def _finish(self):
+        if self.chunk_dir:
+            self._flush()
+            return {k: np.memmap(self._files[k], buffer.dtype, 'r', shape=(self._steps,) + buffer.shape[1:]) for k, buffer in self._buffers.items()}
+        chunks = self._chunks + [{k: buffer[:self._n] for k, buffer in self._buffers.items()}]
+        if len(chunks) == 1:
+            return chunks[0]  # No copy
+        return {k: np.concatenate([chunk[k] for chunk in chunks]) for k in self._buffers}
+
+    def _delete_files(self):
+        for path in self._files.values():
+            path.unlink(missing_ok=True)  # Still readable through open memmaps
+        self._files = {}
+
 
 class ActionRewardResetWrapper(gym.Wrapper):
     """Copied from pydreamer.envs.wrappers."""
@@ -194,6 +194,7 @@ def main():
                 running = False
 
     pygame.quit()
+    env.close()  # Wait for recordings to be written
 
 
 def obs_to_text(obs, env, steps, return_):
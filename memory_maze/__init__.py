@@ -1,64 +1,116 @@
-import os
+import importlib
 
-# NOTE: Env MUJOCO_GL=egl is necessary for headless hardware rendering on GPU,
-# but breaks when running on a CPU machine. Alternatively set MUJOCO_GL=osmesa.
-if 'MUJOCO_GL' not in os.environ:
-    os.environ['MUJOCO_GL'] = 'egl'
+from . import rendering
 
-from . import tasks
+# NOTE: If MUJOCO_GL is not set, pick the fastest working headless backend (egl on GPU
+# machines, osmesa on CPU-only machines), probed once per host and cached.
+rendering.select_backend()
 
-try:
-    # Register gym environments, if gym is available
+# NOTE: memory_maze.tasks (dm_control, labmaze, scipy) takes ~1s to import, so it is
+# imported on first env construction, not here. This keeps `import memory_maze` cheap
+# in short-lived worker processes and CLI tools.
 
-    from typing import Callable
-    from functools import partial as f
 
-    import dm_env
-    import gym
-    from gym.envs.registration import register
+class _LazyTask:
+    """Task constructor that imports memory_maze.tasks when called. Picklable, unlike a closure."""
+
+    def __init__(self, name: str):
+        self.__name__ = name
+
+    def __call__(self, **kwargs):
+        return getattr(importlib.import_module('memory_maze.tasks'), self.__name__)(**kwargs)
+
+    def __repr__(self):
+        return f'<lazy memory_maze.tasks.{self.__name__}>'
+
+
+# Size => task constructor
+SIZES = {
+    '9x9': _LazyTask('memory_maze_9x9'),
+    '11x11': _LazyTask('memory_maze_11x11'),
+    '13x13': _LazyTask('memory_maze_13x13'),
+    '15x15': _LazyTask('memory_maze_15x15'),
+}
 
-    from .gym_wrappers import GymWrapper
+# Env id suffix => task kwargs. Registered as MemoryMaze-{size}{suffix}-v0
+VARIANTS = {
+    # Image-only obs space
+    '': dict(image_only_obs=True),  # Standard
+    '-Vis': dict(image_only_obs=True, good_visibility=True),  # Easily visible targets
+    '-HD': dict(image_only_obs=True, camera_resolution=256),  # High-res camera
+    '-Top': dict(image_only_obs=True, camera_resolution=256, top_camera=True),  # Top-down camera
 
-    def _make_gym_env(dm_task: Callable[[], dm_env.Environment], **kwargs):
-        dmenv = dm_task(**kwargs)
-        return GymWrapper(dmenv)
+    # Extra global observables (dict obs space)
+    '-ExtraObs': dict(global_observables=True),
+    '-ExtraObs-Vis': dict(global_observables=True, good_visibility=True),
+    '-ExtraObs-Top': dict(global_observables=True, camera_resolution=256, top_camera=True),
 
-    sizes = {
-        '9x9': tasks.memory_maze_9x9,
-        '11x11': tasks.memory_maze_11x11,
-        '13x13': tasks.memory_maze_13x13,
-        '15x15': tasks.memory_maze_15x15,
+    # Oracle observables with shortest path shown
+    '-Oracle': dict(image_only_obs=True, global_observables=True, show_path=True),
+    '-Oracle-Top': dict(image_only_obs=True, global_observables=True, show_path=True, camera_resolution=256, top_camera=True),
+    '-Oracle-ExtraObs': dict(global_observables=True, show_path=True),
+
+    # Only global observables, without image (no rendering)
+    '-State': dict(global_observables=True, state_only=True),
+
+    # High control frequency
+    '-HiFreq': dict(image_only_obs=True, control_freq=40),
+    '-HiFreq-Vis': dict(image_only_obs=True, control_freq=40, good_visibility=True),
+    '-HiFreq-HD': dict(image_only_obs=True, control_freq=40, camera_resolution=256),
+
+    # Six colors even for smaller mazes
+    '-6CL': dict(randomize_colors=True, image_only_obs=True),
+    '-6CL-Top': dict(randomize_colors=True, image_only_obs=True, camera_resolution=256, top_camera=True),
+    '-6CL-ExtraObs': dict(randomize_colors=True, global_observables=True),
+}
+
+
+def env_ids():
+    """Returns {env_id: (size, task kwargs)} for all registered environments."""
+    return {
+        f'MemoryMaze-{size}{suffix}-v0': (size, kwargs)
+        for size in SIZES
+        for suffix, kwargs in VARIANTS.items()
     }
 
-    for key, dm_task in sizes.items():
-        # Image-only obs space
-        register(id=f'MemoryMaze-{key}-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True))  # Standard
-        register(id=f'MemoryMaze-{key}-Vis-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, good_visibility=True))  # Easily visible targets
-        register(id=f'MemoryMaze-{key}-HD-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, camera_resolution=256))  # High-res camera
-        register(id=f'MemoryMaze-{key}-Top-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, camera_resolution=256, top_camera=True))  # Top-down camera
-        
-        # Extra global observables (dict obs space)
-        register(id=f'MemoryMaze-{key}-ExtraObs-v0', entry_point=f(_make_gym_env, dm_task, global_observables=True))
-        register(id=f'MemoryMaze-{key}-ExtraObs-Vis-v0', entry_point=f(_make_gym_env, dm_task, global_observables=True, good_visibility=True))
-        register(id=f'MemoryMaze-{key}-ExtraObs-Top-v0', entry_point=f(_make_gym_env, dm_task, global_observables=True, camera_resolution=256, top_camera=True))
-        
-        # Oracle observables with shortest path shown
-        register(id=f'MemoryMaze-{key}-Oracle-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, global_observables=True, show_path=True))
-        register(id=f'MemoryMaze-{key}-Oracle-Top-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, global_observables=True, show_path=True, camera_resolution=256, top_camera=True))
-        register(id=f'MemoryMaze-{key}-Oracle-ExtraObs-v0', entry_point=f(_make_gym_env, dm_task, global_observables=True, show_path=True))
-        
-        # High control frequency
-        register(id=f'MemoryMaze-{key}-HiFreq-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, control_freq=40))
-        register(id=f'MemoryMaze-{key}-HiFreq-Vis-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, control_freq=40, good_visibility=True))
-        register(id=f'MemoryMaze-{key}-HiFreq-HD-v0', entry_point=f(_make_gym_env, dm_task, image_only_obs=True, control_freq=40, camera_resolution=256))
-
-        # Six colors even for smaller mazes
-        register(id=f'MemoryMaze-{key}-6CL-v0', entry_point=f(_make_gym_env, dm_task, randomize_colors=True, image_only_obs=True))
-        register(id=f'MemoryMaze-{key}-6CL-Top-v0', entry_point=f(_make_gym_env, dm_task, randomize_colors=True, image_only_obs=True, camera_resolution=256, top_camera=True))
-        register(id=f'MemoryMaze-{key}-6CL-ExtraObs-v0', entry_point=f(_make_gym_env, dm_task, randomize_colors=True, global_observables=True))
-        
 
+def __getattr__(name):
+    # Lazy submodule access, e.g. memory_maze.tasks without an explicit import
+    if name == 'tasks':
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+_registered = False
+
+try:
+    # Register gymnasium environments, if gymnasium is available.
+    # gymnasium.make_vec() uses MemoryMazeVectorEnv, which steps the envs in worker processes.
+
+    from gymnasium.envs.registration import register as gymnasium_register
+
+    for env_id, (size, kwargs) in env_ids().items():
+        gymnasium_register(
+            id=env_id,
+            entry_point='memory_maze.gymnasium_wrappers:make_env',
+            vector_entry_point='memory_maze.gymnasium_wrappers:make_vector_env',
+            kwargs=dict(size=size, **kwargs),
+        )
+    _registered = True
+
+except ImportError:
+    pass
+
+try:
+    # Register gym environments, if gym is available.
+    # Entry points are strings, so memory_maze.gym_wrappers and tasks are imported by gym.make().
+
+    from gym.envs.registration import register
+
+    for env_id, (size, kwargs) in env_ids().items():
+        register(id=env_id, entry_point='memory_maze.gym_wrappers:make_gym_env', kwargs=dict(size=size, **kwargs))
 
 except ImportError:
-    print('memory_maze: gym environments not registered.')
-    raise
+    if not _registered:
+        print('memory_maze: gym environments not registered.')
+        raise
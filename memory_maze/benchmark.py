@@ -0,0 +1,355 @@
+"""Reset and step throughput benchmark for the registered environments.
+
+Run all 9x9 variants on both headless backends and save the results:
+
+    python -m memory_maze.benchmark --envs 'MemoryMaze-9x9*' --backends egl osmesa --output bench.json
+
+Compare against a stored baseline (exits with code 1 on regression):
+
+    python -m memory_maze.benchmark --envs 'MemoryMaze-9x9*' --backends osmesa --baseline bench.json
+
+Measure the observation wrapper overhead, unfused vs fused (see tasks._memory_maze(fused_observations)):
+
+    python -m memory_maze.benchmark --envs 'MemoryMaze-9x9*' --wrappers
+
+Measure `import memory_maze` and first env construction time, from `python -X importtime`:
+
+    python -m memory_maze.benchmark --import-time
+
+Each (env, backend) pair is measured in a fresh subprocess, so that MUJOCO_GL can be
+set per backend and peak RSS is not shared between environments.
+"""
+import argparse
+import copy
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BACKENDS = ['egl', 'osmesa']
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+# Metric => True if higher is better
+METRICS = {
+    'steps_per_sec': True,
+    'reset_p50_ms': False,
+    'reset_p99_ms': False,
+    'peak_rss_mb': False,
+    'construct_ms': False,
+}
+
+
+class _StageTimer:
+    """Measures time spent inside the wrapped dm_env, i.e. excluding the outer wrappers."""
+
+    def __init__(self, env):
+        self.env = env
+        self.elapsed = {'reset': 0.0, 'step': 0.0}
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def reset(self, *args, **kwargs):
+        t = time.perf_counter()
+        ts = self.env.reset(*args, **kwargs)
+        self.elapsed['reset'] += time.perf_counter() - t
+        return ts
+
+    def step(self, action):
+        t = time.perf_counter()
+        ts = self.env.step(action)
+        self.elapsed['step'] += time.perf_counter() - t
+        return ts
+
+
+def benchmark_env(env_id: str, steps: int = 1000, resets: int = 20, seed: int = 0) -> dict:
+    """Benchmarks a registered environment in the current process."""
+    import resource
+
+    from memory_maze import SIZES, env_ids
+    from memory_maze import tasks  # noqa: F401 - imported before timing construction, see measure_import_time()
+    from memory_maze.wrappers import Wrapper
+
+    size, kwargs = env_ids()[env_id]
+    stages = {}
+
+    t = time.perf_counter()
+    env = SIZES[size](seed=seed, **kwargs)
+    stages['construct_s'] = time.perf_counter() - t
+
+    timer = None
+    if isinstance(env, Wrapper):
+        wrapper = env
+        while isinstance(wrapper.env, Wrapper):
+            wrapper = wrapper.env
+        timer = wrapper.env = _StageTimer(wrapper.env)
+
+    t = time.perf_counter()
+    env.reset()
+    stages['first_reset_s'] = time.perf_counter() - t
+
+    reset_times = []
+    for _ in range(resets):
+        t = time.perf_counter()
+        env.reset()
+        reset_times.append(time.perf_counter() - t)
+
+    rng = np.random.RandomState(seed)
+    num_actions = env.action_spec().num_values
+    env.reset()
+    if timer:
+        timer.elapsed['step'] = 0.0
+    step_time = 0.0
+    for _ in range(steps):
+        action = rng.randint(num_actions)
+        t = time.perf_counter()
+        ts = env.step(action)
+        step_time += time.perf_counter() - t
+        if ts.last():
+            env.reset()  # Not included in step time
+    env.close()
+
+    stages['reset_mean_ms'] = float(np.mean(reset_times)) * 1000
+    stages['step_mean_ms'] = step_time / steps * 1000
+    if timer:
+        stages['step_env_ms'] = timer.elapsed['step'] / steps * 1000  # dm_control: physics, rendering, observables
+        stages['step_wrappers_ms'] = stages['step_mean_ms'] - stages['step_env_ms']
+    return {
+        'env_id': env_id,
+        'backend': os.environ.get('MUJOCO_GL'),
+        'steps_per_sec': steps / step_time,
+        'reset_p50_ms': float(np.percentile(reset_times, 50)) * 1000,
+        'reset_p99_ms': float(np.percentile(reset_times, 99)) * 1000,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # Linux reports KB
+        'construct_ms': stages['construct_s'] * 1000,
+        'stages': stages,
+    }
+
+
+class _Replay:
+    """Stands in for the wrapped dm_env, returning prerecorded timesteps."""
+
+    def __init__(self, env, timesteps):
+        self.env = env
+        self.timesteps = iter(timesteps)
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def reset(self):
+        return next(self.timesteps)
+
+    def step(self, action):
+        return next(self.timesteps)
+
+
+def benchmark_wrappers(env_id: str, steps: int = 1000, seed: int = 0) -> dict:
+    """Times the observation wrappers alone, unfused vs fused, on the same recorded dm_env timesteps.
+
+    Raises AssertionError if fused observations differ from unfused.
+    """
+    from memory_maze import SIZES, env_ids
+    from memory_maze.wrappers import Wrapper
+
+    size, kwargs = env_ids()[env_id]
+    envs = {name: SIZES[size](seed=seed, fused_observations=fused, **kwargs) for name, fused in [('unfused', False), ('fused', True)]}
+    inner = {}
+    for name, env in envs.items():
+        wrapper = env
+        while isinstance(wrapper.env, Wrapper):
+            wrapper = wrapper.env
+        inner[name] = wrapper
+
+    # Record timesteps of the underlying dm_env
+    dmenv = inner['unfused'].env
+    timesteps = [dmenv.reset()]
+    rng = np.random.RandomState(seed)
+    for _ in range(steps):
+        ts = dmenv.step(rng.uniform(-1, 1, 2))
+        timesteps.append(ts if not ts.last() else dmenv.reset())
+
+    result = {'env_id': env_id}
+    outputs = {}
+    for name, env in envs.items():
+        inner[name].env = _Replay(inner[name].env, copy.deepcopy(timesteps))  # Wrappers modify observations in place
+        outputs[name] = [env.reset().observation]
+        t = time.perf_counter()
+        for _ in range(steps):
+            outputs[name].append(env.step(0).observation)
+        result[f'{name}_us'] = (time.perf_counter() - t) / steps * 1e6
+        env.close()
+
+    for obs, obs_fused in zip(outputs['unfused'], outputs['fused']):
+        if not isinstance(obs, dict):
+            obs, obs_fused = {None: obs}, {None: obs_fused}
+        assert obs.keys() == obs_fused.keys(), (obs.keys(), obs_fused.keys())
+        for key in obs:
+            assert np.array_equal(obs[key], obs_fused[key]) and obs[key].dtype == obs_fused[key].dtype, f'{env_id} {key} differs'
+    return result
+
+
+IMPORT_TIME_SCRIPTS = {
+    'import': 'import memory_maze',
+    'first_env': 'import memory_maze; memory_maze.SIZES["9x9"]()',
+}
+
+
+def measure_import_time(repeats: int = 5, top: int = 10) -> dict:
+    """Parses `python -X importtime` of a cold `import memory_maze` and of the first env construction.
+
+    Reports the median total import time (ms) of each script over fresh subprocesses,
+    and the modules with the highest cumulative time of the last run.
+    """
+    env = dict(os.environ)
+    env.setdefault('MUJOCO_GL', 'egl')  # Don't include the rendering backend probe
+    result = {}
+    for name, script in IMPORT_TIME_SCRIPTS.items():
+        totals = []
+        for _ in range(repeats):
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], env=env, capture_output=True, text=True)
+            modules = _parse_importtime(proc.stderr)
+            totals.append(sum(self_us for self_us, _ in modules.values()) / 1000)
+        result[f'{name}_ms'] = float(np.median(totals))
+        result[f'{name}_top'] = {module: cumulative / 1000 for module, (_, cumulative) in
+                                 sorted(modules.items(), key=lambda item: -item[1][1])[:top]}
+    return result
+
+
+def _parse_importtime(stderr: str) -> Dict[str, tuple]:
+    """{module: (self us, cumulative us)} from `python -X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        modules[module.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def run_benchmarks(env_ids: List[str], backends: List[str] = BACKENDS, steps: int = 1000, resets: int = 20, seed: int = 0) -> dict:
+    """Benchmarks each env on each backend in a separate subprocess."""
+    results = {}
+    for backend in backends:
+        for env_id in env_ids:
+            key = f'{env_id}@{backend}'
+            print(f'Benchmarking {key}...', file=sys.stderr)
+            results[key] = _run_worker(env_id, backend, steps, resets, seed)
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'steps': steps,
+            'resets': resets,
+            'seed': seed,
+            'import_time': measure_import_time(),
+        },
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """Returns descriptions of metrics that are worse than baseline by more than tolerance (relative)."""
+    regressions = []
+    for key, result in results['results'].items():
+        base = baseline['results'].get(key)
+        if base is None or 'error' in result or 'error' in base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in result or metric not in base:
+                continue  # Baseline from an older version
+            change = (result[metric] - base[metric]) / base[metric]
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f'{key} {metric}: {base[metric]:.1f} => {result[metric]:.1f} ({change:+.0%})')
+    return regressions
+
+
+def _run_worker(env_id, backend, steps, resets, seed) -> dict:
+    env = dict(os.environ, MUJOCO_GL=backend)
+    env.pop('PYOPENGL_PLATFORM', None)  # Let dm_control choose it for the backend
+    cmd = [sys.executable, '-m', 'memory_maze.benchmark', '--worker', env_id,
+           '--steps', str(steps), '--resets', str(resets), '--seed', str(seed)]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    error = proc.stderr.strip().splitlines()
+    return {'env_id': env_id, 'backend': backend, 'error': error[-1] if error else f'exit code {proc.returncode}'}
+
+
+def _print_import_time(import_time: dict):
+    print(f'import memory_maze: {import_time["import_ms"]:.0f}ms, imports incl. first env: {import_time["first_env_ms"]:.0f}ms')
+    for module, ms in import_time['import_top'].items():
+        print(f'  {module:<43} {ms:>8.1f}ms')
+
+
+def _print_results(results: dict):
+    if 'import_time' in results['meta']:
+        _print_import_time(results['meta']['import_time'])
+    print(f'{"env@backend":<45} {"steps/s":>9} {"reset p50":>10} {"reset p99":>10} {"RSS MB":>8} {"construct":>10}')
+    for key, r in results['results'].items():
+        if 'error' in r:
+            print(f'{key:<45} ERROR: {r["error"]}')
+        else:
+            print(f'{key:<45} {r["steps_per_sec"]:>9.1f} {r["reset_p50_ms"]:>8.1f}ms {r["reset_p99_ms"]:>8.1f}ms {r["peak_rss_mb"]:>8.0f} {r["construct_ms"]:>8.0f}ms')
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--envs', type=str, nargs='+', default=['*'], help='Env id patterns, e.g. "MemoryMaze-9x9*"')
+    parser.add_argument('--backends', type=str, nargs='+', default=BACKENDS)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--resets', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, help='Save results JSON')
+    parser.add_argument('--baseline', type=str, help='Compare with results JSON')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--wrappers', action='store_true', help='Benchmark unfused vs fused observation wrappers')
+    parser.add_argument('--import-time', action='store_true', help='Only measure import time')
+    parser.add_argument('--worker', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        result = benchmark_env(args.worker, steps=args.steps, resets=args.resets, seed=args.seed)
+        print(RESULT_PREFIX + json.dumps(result))
+        return
+
+    if args.import_time:
+        _print_import_time(measure_import_time())
+        return
+
+    from memory_maze import env_ids
+    all_ids = list(env_ids())
+    selected = [env_id for env_id in all_ids if any(fnmatch.fnmatch(env_id, pattern) for pattern in args.envs)]
+    if args.wrappers:
+        print(f'{"env":<45} {"unfused":>10} {"fused":>10}')
+        for env_id in selected:
+            r = benchmark_wrappers(env_id, steps=args.steps, seed=args.seed)
+            print(f'{env_id:<45} {r["unfused_us"]:>8.1f}us {r["fused_us"]:>8.1f}us')
+        return
+    results = run_benchmarks(selected, args.backends, steps=args.steps, resets=args.resets, seed=args.seed)
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Offline dataset generation with a scripted policy, as used for the published datasets.
+
+The policy navigates to randomly chosen points in the maze, following the shortest path
+(from the ExtraObs observables), and takes a random action with probability `action_noise`.
+
+Generate 30k trajectories of Memory Maze 9x9 on all cores:
+
+    python -m memory_maze.datagen ./memory-maze-9x9/train --size 9x9 -n 30000
+
+Each worker process builds the environment once with the given seed, and generates
+episode i with reset(episode_index=i), so the episode depends only on (seed, i). It is
+saved as {i:06}.npz, in the format of gui/recording.py. Episodes that are already saved are skipped, so an interrupted run
+can be resumed by running the same command again.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from memory_maze.oracle import DistanceField, navigation_actions
+from memory_maze.tasks import ACTIONS
+
+N_ACTIONS = len(ACTIONS)
+
+_envs: Dict[Any, Any] = {}  # Environments of this process, by (size, seed, env_kwargs)
+
+
+class ScriptedPolicy:
+    """Navigates to random free cells, turning in place if the next cell on the path
+    is more than turn_angle away, and moving forward with a turn if it's more than
+    forward_angle away."""
+
+    def __init__(self, rng: np.random.RandomState, action_noise: float = 0.1, forward_angle: float = 15.0, turn_angle: float = 45.0):
+        self.rng = rng
+        self.action_noise = action_noise
+        self.forward_angle = forward_angle
+        self.turn_angle = turn_angle
+        self.goal = None
+        self.field = None
+
+    def reset(self):
+        self.goal = None
+        self.field = None
+
+    def __call__(self, obs: Dict[str, np.ndarray]) -> int:
+        maze = obs['maze_layout']
+        x, y = obs['agent_pos']
+        cell = (int(x), int(y))
+        if self.goal is None or cell == self.goal:
+            self._new_goal(maze, cell)
+
+        if self.rng.rand() < self.action_noise:
+            return self.rng.randint(N_ACTIONS)
+
+        path = self.field.path(cell)
+        if not path or len(path) < 2:
+            self.goal = None  # Unreachable (e.g. pushed into a wall corner), pick a new goal next step
+            return self.rng.randint(N_ACTIONS)
+        waypoint = np.array([path[1]]) + 0.5  # Center of the next cell
+        return int(navigation_actions(obs['agent_pos'][None], obs['agent_dir'][None], waypoint, self.forward_angle, self.turn_angle)[0])
+
+    def _new_goal(self, maze: np.ndarray, cell):
+        free = np.argwhere(maze != 0)  # (y, x)
+        while True:
+            y, x = free[self.rng.randint(len(free))]
+            if (x, y) != cell:
+                break
+        self.goal = (int(x), int(y))
+        self.field = DistanceField(maze, self.goal)
+
+
+def policy_seed(seed: int, index: int) -> int:
+    """Seed of the policy RandomState of the episode, independent of the env streams of (seed, index)."""
+    return int(np.random.SeedSequence([seed, index]).spawn(1)[0].generate_state(1)[0] % 2147483647)
+
+
+def generate_episode(size: str, seed: int, index: int, action_noise: float = 0.1, **env_kwargs) -> Dict[str, np.ndarray]:
+    """Runs one episode of the scripted policy. Returns the recorded trajectory in the format
+    of gui/recording.py: observations plus one-hot action, reward, terminal and reset.
+
+    The environment is created on the first call and reused by later calls with the same
+    size, seed and env_kwargs."""
+    key = (size, seed, tuple(sorted(env_kwargs.items())))
+    if key not in _envs:
+        from memory_maze import SIZES
+        _envs[key] = SIZES[size](seed=seed, global_observables=True, image_only_obs=False, **env_kwargs)
+    env = _envs[key]
+    policy = ScriptedPolicy(np.random.RandomState(policy_seed(seed, index)), action_noise)
+
+    ts = env.reset(episode_index=index)
+    episode = _EpisodeBuffer()
+    episode.add(ts.observation, None, 0.0, False, True)
+    while not ts.last():
+        action = policy(ts.observation)
+        ts = env.step(action)
+        episode.add(ts.observation, action, ts.reward, ts.last() and ts.discount == 0.0, False)
+    return episode.data()
+
+
+class _EpisodeBuffer:
+    # Steps are written into per-key arrays, preallocated from the shapes and dtypes of the
+    # first step as in gui/recording.py CollectWrapper. Capacity doubles if the episode is
+    # longer than expected.
+
+    def __init__(self, capacity: int = 1001):
+        self.capacity = capacity
+        self.buffers: Dict[str, np.ndarray] = {}
+        self.n = 0
+
+    def add(self, obs, action, reward, terminal, reset):
+        if not self.buffers:
+            self.buffers = {k: np.empty((self.capacity,) + np.shape(v), np.asarray(v).dtype) for k, v in obs.items()}
+            self.buffers.update(action=np.empty((self.capacity, N_ACTIONS)), reward=np.empty(self.capacity),
+                                terminal=np.empty(self.capacity, bool), reset=np.empty(self.capacity, bool))
+        if self.n == self.capacity:
+            self.capacity *= 2
+            self.buffers = {k: np.resize(buffer, (self.capacity,) + buffer.shape[1:]) for k, buffer in self.buffers.items()}
+        for k, v in obs.items():
+            self.buffers[k][self.n] = v
+        self.buffers['action'][self.n] = 0.0
+        if action is not None:
+            self.buffers['action'][self.n, action] = 1.0
+        self.buffers['reward'][self.n] = reward
+        self.buffers['terminal'][self.n] = terminal
+        self.buffers['reset'][self.n] = reset
+        self.n += 1
+
+    def data(self) -> Dict[str, np.ndarray]:
+        return {k: buffer[:self.n] for k, buffer in self.buffers.items()}
+
+
+def generate_dataset(
+    path: Union[str, Path],
+    n_episodes: int,
+    size: str = '9x9',
+    seed: int = 0,
+    action_noise: float = 0.1,
+    workers: int = 1,
+    **env_kwargs,
+):
+    """Generates episodes 0..n_episodes-1, skipping the ones already saved in path."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    pending = [i for i in range(n_episodes) if not (path / f'{i:06}.npz').exists()]
+    print(f'Generating {len(pending)} episodes ({n_episodes - len(pending)} already done)')
+
+    jobs = [(path, size, seed, i, action_noise, env_kwargs) for i in pending]
+    start = time.time()
+    steps = 0
+    with mp.get_context('spawn').Pool(workers) as pool:
+        for done, n in enumerate(pool.imap_unordered(_generate_and_save, jobs), 1):
+            steps += n
+            elapsed = time.time() - start
+            print(f'Generated {done}/{len(pending)} episodes ({steps / elapsed:.0f} steps/s, {done / elapsed * 3600:.0f} episodes/h)')
+
+
+def _generate_and_save(args) -> int:
+    path, size, seed, index, action_noise, env_kwargs = args
+    data = generate_episode(size, seed, index, action_noise, **env_kwargs)
+    tmp_path = path / f'{index:06}.npz.tmp'
+    with tmp_path.open('wb') as f:
+        np.savez_compressed(f, **data)
+    os.replace(tmp_path, path / f'{index:06}.npz')  # Atomic, so a crash never leaves a partial episode
+    return len(data['reward']) - 1
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('-n', '--n_episodes', type=int, default=30000)
+    parser.add_argument('--size', type=str, default='9x9', choices=['9x9', '11x11', '13x13', '15x15'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--action-noise', type=float, default=0.1)
+    parser.add_argument('--camera-resolution', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=mp.cpu_count())
+    args = parser.parse_args(argv)
+    generate_dataset(
+        args.path,
+        args.n_episodes,
+        size=args.size,
+        seed=args.seed,
+        action_noise=args.action_noise,
+        workers=args.workers,
+        camera_resolution=args.camera_resolution,
+    )
+
+
+if __name__ == '__main__':
+    main()
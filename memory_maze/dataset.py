@@ -0,0 +1,208 @@
+"""Memory-mapped trajectory dataset, converted from the NPZ files of the offline dataset.
+
+Convert a directory of NPZ trajectories (searched recursively):
+
+    python -m memory_maze.dataset ./memory-maze-9x9/train ./memory-maze-9x9-mmap/train
+
+and read arbitrary windows without loading whole episodes:
+
+    data = TrajectoryDataset('./memory-maze-9x9-mmap/train')
+    window = data.read(episode=12, t0=100, t1=150)  # {'image': (50, 64, 64, 3), ...}
+
+Episodes are concatenated along the time axis into shards of about `shard_steps` steps,
+with one uncompressed .npy file per shard and key, so reads are served straight from
+the page cache or disk, without decompression.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import time
+import zipfile
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npy'
+SHARD_DIR = 'shard_{:05}'
+
+
+class TrajectoryDataset:
+    """Reader of the memory-mapped format written by convert_npz().
+
+    The global index holds (shard, start, length) of each episode, in the sorted order
+    of the NPZ file names, which are kept in meta['episodes']. keys are the ones read by
+    default; read() and sample() can also ask for other keys of the dataset.
+    """
+
+    def __init__(self, path: Union[str, Path], keys: Optional[Sequence[str]] = None):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / META_FILE).read_text())
+        self.index = np.load(self.path / INDEX_FILE)
+        self.keys = list(keys) if keys is not None else list(self.meta['keys'])
+        self._check_keys(self.keys)
+        self.episodes = self.meta['episodes']
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def n_steps(self) -> int:
+        return int(self.index[:, 2].sum())
+
+    def episode_length(self, episode: int) -> int:
+        return int(self.index[episode, 2])
+
+    def read(self, episode: int, t0: int = 0, t1: Optional[int] = None, keys: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """Steps [t0, t1) of the episode, as read-only views of the memory-mapped shard."""
+        shard, start, length = self.index[episode]
+        t0, t1, _ = slice(t0, t1).indices(length)
+        keys = keys or self.keys
+        arrays = self._shard(shard, keys)
+        return {key: arrays[key][start + t0:start + t1] for key in keys}
+
+    def sample(self, batch_size: int, length: int, rng: np.random.RandomState, keys: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """Random windows of the given length, stacked as (batch_size, length, ...) arrays."""
+        lengths = self.index[:, 2]
+        keys = keys or self.keys
+        self._check_keys(keys)
+        valid = np.flatnonzero(lengths >= length)
+        assert len(valid) > 0, f'No episodes with at least {length} steps'
+        episodes = rng.choice(valid, batch_size, p=(lengths[valid] - length + 1) / np.sum(lengths[valid] - length + 1))
+        batch = {key: np.empty((batch_size, length) + tuple(self.meta['keys'][key]['shape']), self.meta['keys'][key]['dtype'])
+                 for key in keys}
+        for i, episode in enumerate(episodes):
+            t0 = rng.randint(lengths[episode] - length + 1)
+            for key, window in self.read(episode, t0, t0 + length, keys).items():
+                batch[key][i] = window
+        return batch
+
+    def _shard(self, shard: int, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        # Each key of a shard is memory-mapped the first time it's read
+        arrays = self._shards.setdefault(shard, {})
+        missing = [key for key in keys if key not in arrays]
+        if missing:
+            self._check_keys(missing)
+            shard_dir = self.path / SHARD_DIR.format(shard)
+            arrays.update({key: np.load(shard_dir / f'{key}.npy', mmap_mode='r') for key in missing})
+        return arrays
+
+    def _check_keys(self, keys: Sequence[str]):
+        unknown = [key for key in keys if key not in self.meta['keys']]
+        if unknown:
+            raise ValueError(f'Keys {unknown} not in dataset, available: {list(self.meta["keys"])}')
+
+
+def _imap_bounded(pool, fn, items, window: int):
+    # Like pool.imap(), but submits the next item only when a result is consumed, so that
+    # workers cannot run ahead of a slow consumer and fill memory with finished results
+    items = iter(items)
+    pending = deque(pool.apply_async(fn, (item,)) for item in itertools.islice(items, window))
+    while pending:
+        result = pending.popleft().get()
+        pending.extend(pool.apply_async(fn, (item,)) for item in itertools.islice(items, 1))
+        yield result
+
+
+def convert_npz(
+    src: Union[str, Path],
+    dst: Union[str, Path],
+    shard_steps: int = 1000000,
+    workers: int = 1,
+):
+    """Converts all NPZ trajectories under src into the TrajectoryDataset format in dst.
+
+    Episodes are decompressed in worker processes, and written in order. At most 2 * workers
+    decompressed episodes are held in memory at a time.
+    """
+    src, dst = Path(src), Path(dst)
+    files = sorted(src.rglob('*.npz'))
+    assert files, f'No NPZ files found in {src}'
+    headers = [_read_headers(f) for f in files]
+    keys = {key: {'shape': list(shape[1:]), 'dtype': dtype.str} for key, (shape, dtype) in headers[0].items()}
+    lengths = []
+    for f, header in zip(files, headers):
+        if {key: (list(shape[1:]), dtype.str) for key, (shape, dtype) in header.items()} != {key: (v['shape'], v['dtype']) for key, v in keys.items()}:
+            raise ValueError(f'{f} has different keys, shapes or dtypes than {files[0]}')
+        lengths.append(_check_length(f, header))
+
+    # Assign whole episodes to shards
+    index = np.zeros((len(files), 3), np.int64)
+    shard, start = 0, 0
+    for i, length in enumerate(lengths):
+        if start > 0 and start + length > shard_steps:
+            shard, start = shard + 1, 0
+        index[i] = shard, start, length
+        start += length
+    n_shards = shard + 1
+
+    dst.mkdir(parents=True, exist_ok=True)
+    start_time = time.time()
+    with mp.get_context('spawn').Pool(workers) as pool:
+        episodes = _imap_bounded(pool, _load_npz, files, 2 * workers)
+        for shard in range(n_shards):
+            in_shard = np.flatnonzero(index[:, 0] == shard)
+            shard_dir = dst / SHARD_DIR.format(shard)
+            shard_dir.mkdir(exist_ok=True)
+            n = int(index[in_shard, 2].sum())
+            arrays = {key: np.lib.format.open_memmap(shard_dir / f'{key}.npy', mode='w+', dtype=v['dtype'], shape=(n,) + tuple(v['shape']))
+                      for key, v in keys.items()}
+            for i in in_shard:
+                data = next(episodes)
+                _, start, length = index[i]
+                for key, array in arrays.items():
+                    array[start:start + length] = data[key]
+                print(f'Converted {i + 1}/{len(files)} episodes ({(i + 1) / (time.time() - start_time):.1f}/s)')
+            for array in arrays.values():
+                array.flush()
+            del arrays
+
+    np.save(dst / INDEX_FILE, index)
+    meta = dict(keys=keys, n_episodes=len(files), n_steps=int(index[:, 2].sum()), n_shards=n_shards,
+                episodes=[str(f.relative_to(src).with_suffix('')) for f in files])
+    (dst / META_FILE).write_text(json.dumps(meta, indent=2))
+
+
+def _read_headers(path: Path) -> Dict[str, Tuple[tuple, np.dtype]]:
+    """Shapes and dtypes of the arrays in an NPZ file, without decompressing the data."""
+    headers = {}
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            with zf.open(name) as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            headers[name[:-len('.npy')]] = (shape, dtype)
+    return headers
+
+
+def _check_length(path: Path, header: Dict[str, Tuple[tuple, np.dtype]]) -> int:
+    lengths = {shape[0] for shape, _ in header.values()}
+    if len(lengths) != 1:
+        raise ValueError(f'{path} has arrays of different lengths: {lengths}')
+    return lengths.pop()
+
+
+def _load_npz(path: Path) -> Dict[str, np.ndarray]:
+    with np.load(path) as data:
+        return {key: data[key] for key in data.keys()}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', type=str, help='Directory with NPZ trajectories')
+    parser.add_argument('dst', type=str)
+    parser.add_argument('--shard-steps', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=mp.cpu_count())
+    args = parser.parse_args(argv)
+    convert_npz(args.src, args.dst, shard_steps=args.shard_steps, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
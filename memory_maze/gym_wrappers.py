@@ -14,8 +14,8 @@ class GymWrapper(gym.Env):
         self.action_space = _convert_to_space(env.action_spec())
         self.observation_space = _convert_to_space(env.observation_spec())
 
-    def reset(self) -> Any:
-        ts = self.env.reset()
+    def reset(self, **kwargs) -> Any:
+        ts = self.env.reset(**kwargs)
         return ts.observation
 
     def step(self, action) -> Tuple[Any, float, bool, dict]:
@@ -29,6 +29,12 @@ class GymWrapper(gym.Env):
             info['TimeLimit.truncated'] = True  # acme.GymWrapper understands this and converts back to dm_env.truncation()
         return ts.observation, ts.reward, done, info
 
+    def snapshot(self) -> bytes:
+        return self.env.snapshot()
+
+    def restore(self, snapshot: bytes):
+        self.env.restore(snapshot)
+
 
 def _convert_to_space(spec: Any) -> gym.Space:
     # Inverse of acme.gym_wrappers._convert_to_spec
@@ -57,3 +63,9 @@ def _convert_to_space(spec: Any) -> gym.Space:
         return spaces.Dict({key: _convert_to_space(value) for key, value in spec.items()})
 
     raise ValueError(f'Unexpected spec: {spec}')
+
+
+def make_gym_env(size: str, **kwargs) -> GymWrapper:
+    """Entry point of the registered gym environments."""
+    from memory_maze import SIZES
+    return GymWrapper(SIZES[size](**kwargs))
@@ -0,0 +1,152 @@
+import functools
+from typing import Any, Optional, Sequence, Tuple, Union
+
+import dm_env
+import gymnasium
+import numpy as np
+from dm_env import specs
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from memory_maze.vec_env import MemoryMazeVecEnv
+
+
+class MemoryMazeEnv(gymnasium.Env):
+    """Gymnasium interface, with terminated/truncated split from the dm_env discount."""
+
+    metadata = {'render_modes': []}
+
+    def __init__(self, env: dm_env.Environment):
+        self.env = env
+        self.action_space = _convert_to_space(env.action_spec())
+        self.observation_space = _convert_to_space(env.observation_spec())
+
+    def reset(self, *, seed: Optional[int] = None, options: Optional[dict] = None) -> Tuple[Any, dict]:
+        """Seeding follows MemoryMazeEnvironment.reset(): reset(seed=s) is episode 0 of seed s,
+        and options={'episode_index': k} regenerates episode k."""
+        super().reset(seed=seed)
+        ts = self.env.reset(seed=seed, episode_index=(options or {}).get('episode_index'))
+        return _own_observation(ts.observation), {}
+
+    def step(self, action) -> Tuple[Any, float, bool, bool, dict]:
+        ts = self.env.step(action)
+        assert not ts.first(), "dm_env.step() caused reset, reward will be undefined."
+        assert ts.reward is not None
+        terminated = ts.last() and ts.discount == 0.0
+        truncated = ts.last() and not terminated
+        return _own_observation(ts.observation), ts.reward, terminated, truncated, {}
+
+    def close(self):
+        self.env.close()
+
+    def snapshot(self) -> bytes:
+        return self.env.snapshot()
+
+    def restore(self, snapshot: bytes):
+        self.env.restore(snapshot)
+
+
+class MemoryMazeVectorEnv(VectorEnv):
+    """Gymnasium vector env over MemoryMazeVecEnv.
+
+    Observations are the (num_envs, ...) shared-memory arrays of the workers, without
+    per-env observation dicts. Finished envs are reset in the same step (SAME_STEP autoreset):
+    the last observation of the episode is in info['final_obs'], for envs where info['_final_obs'].
+    """
+
+    metadata = {'render_modes': [], 'autoreset_mode': AutoresetMode.SAME_STEP}
+
+    def __init__(self, env_fns: Sequence, copy: bool = True):
+        self.env = MemoryMazeVecEnv(env_fns, final_observations=True)
+        self.num_envs = self.env.num_envs
+        self.copy = copy
+        self.single_action_space = _convert_to_space(self.env.action_spec())
+        self.single_observation_space = _convert_to_space(self.env.observation_spec())
+        self.action_space = batch_space(self.single_action_space, self.num_envs)
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+
+    def reset(self, *, seed: Optional[Union[int, Sequence[int]]] = None, options: Optional[dict] = None) -> Tuple[Any, dict]:
+        """reset(seed=s) seeds the envs with s, s+1, ... like make_vec_env(). options['episode_index']
+        may be an int (the same for all envs) or a sequence of per-env indices."""
+        super().reset(seed=seed if isinstance(seed, (int, type(None))) else None)
+        if isinstance(seed, int):
+            seed = [seed + i for i in range(self.num_envs)]
+        episode_index = (options or {}).get('episode_index')
+        if isinstance(episode_index, int):
+            episode_index = [episode_index] * self.num_envs
+        obs = self.env.reset(copy=self.copy, seed=seed, episode_index=episode_index)
+        return obs, {}
+
+    def step(self, actions) -> Tuple[Any, np.ndarray, np.ndarray, np.ndarray, dict]:
+        obs, reward, done, info = self.env.step(actions, copy=self.copy)
+        truncated = info['TimeLimit.truncated']
+        terminated = done & ~truncated
+        infos = {}
+        if done.any():
+            final_obs = np.empty(self.num_envs, dtype=object)
+            for i in np.flatnonzero(done):
+                final_obs[i] = _index(info['final_observation'], i)
+            final_info = np.empty(self.num_envs, dtype=object)
+            final_info[done] = [{} for _ in range(done.sum())]
+            infos.update(final_obs=final_obs, _final_obs=done, final_info=final_info, _final_info=done)
+        return obs, reward, terminated, truncated, infos
+
+    def close_extras(self, **kwargs):
+        self.env.close()
+
+
+def _own_observation(obs: Any) -> Any:
+    # maze_layout is one read-only array shared by all steps of an episode (MazeLayoutWrapper),
+    # but Gymnasium callers expect observations they can keep and modify
+    if isinstance(obs, dict) and 'maze_layout' in obs:
+        obs = dict(obs, maze_layout=obs['maze_layout'].copy())
+    return obs
+
+
+def _index(obs: Any, i: int) -> Any:
+    if isinstance(obs, dict):
+        return {key: value[i] for key, value in obs.items()}
+    return obs[i]
+
+
+def _convert_to_space(spec: Any) -> gymnasium.Space:
+    # Same as gym_wrappers._convert_to_space, for gymnasium spaces
+
+    if isinstance(spec, specs.DiscreteArray):
+        return spaces.Discrete(spec.num_values)
+
+    if isinstance(spec, specs.BoundedArray):
+        return spaces.Box(
+            shape=spec.shape,
+            dtype=spec.dtype,
+            low=spec.minimum.item() if len(spec.minimum.shape) == 0 else spec.minimum,
+            high=spec.maximum.item() if len(spec.maximum.shape) == 0 else spec.maximum)
+
+    if isinstance(spec, specs.Array):
+        return spaces.Box(
+            shape=spec.shape,
+            dtype=spec.dtype,
+            low=-np.inf,
+            high=np.inf)
+
+    if isinstance(spec, tuple):
+        return spaces.Tuple(_convert_to_space(s) for s in spec)
+
+    if isinstance(spec, dict):
+        return spaces.Dict({key: _convert_to_space(value) for key, value in spec.items()})
+
+    raise ValueError(f'Unexpected spec: {spec}')
+
+
+def make_env(size: str, **kwargs) -> MemoryMazeEnv:
+    """Entry point of the registered gymnasium environments."""
+    from memory_maze import SIZES
+    return MemoryMazeEnv(SIZES[size](**kwargs))
+
+
+def make_vector_env(size: str, num_envs: int, seed: Optional[int] = None, copy: bool = True, **kwargs) -> MemoryMazeVectorEnv:
+    """Vector entry point of the registered gymnasium environments (gymnasium.make_vec)."""
+    from memory_maze import SIZES
+    env_fns = [functools.partial(SIZES[size], seed=None if seed is None else seed + i, **kwargs) for i in range(num_envs)]
+    return MemoryMazeVectorEnv(env_fns, copy=copy)
@@ -0,0 +1,192 @@
+"""Bank of pre-generated maze layouts, so that episode reset doesn't need to run labmaze.
+
+Generate a bank for the 15x15 maze:
+
+    python -m memory_maze.layout_bank ./bank_15x15 --maze-size 15 --max-rooms 9 --room-max-size 3 --min-targets 6 -n 1000000
+
+and use it with `tasks.memory_maze_15x15(layout_bank='./bank_15x15')`.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import time
+from pathlib import Path
+from typing import Tuple, Union
+
+import numpy as np
+
+from memory_maze.maze import TextMazeVaryingWalls
+
+META_FILE = 'meta.json'
+ENTITY_FILE = 'entity_layer.npy'
+VARIATIONS_FILE = 'variations_layer.npy'
+
+
+class LayoutBank:
+    """Memory-mapped bank of TextMazeVaryingWalls layouts.
+
+    Layouts are stored as (N, height, width) uint8 character arrays. Spawn and target
+    candidates are the 'P' and 'G' cells of the entity layer, and every stored layout
+    has at least `min_targets` target candidates, so target placement never fails.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        path = Path(path)
+        self.meta = json.loads((path / META_FILE).read_text())
+        self._entity_layer = np.load(path / ENTITY_FILE, mmap_mode='r')
+        self._variations_layer = np.load(path / VARIATIONS_FILE, mmap_mode='r')
+        self.height = self.meta['height']
+        self.width = self.meta['width']
+        self.min_targets = self.meta['min_targets']
+
+    def __len__(self):
+        return self._entity_layer.shape[0]
+
+    def __getitem__(self, index) -> Tuple[np.ndarray, np.ndarray]:
+        return _to_chars(self._entity_layer[index]), _to_chars(self._variations_layer[index])
+
+    def check_compatible(self, **maze_kwargs):
+        for key, value in maze_kwargs.items():
+            if self.meta[key] != value:
+                raise ValueError(f'Layout bank was generated with {key}={self.meta[key]}, but {value} is required')
+
+
+class LayoutBankMaze:
+    """Replacement for TextMazeVaryingWalls, which draws layouts from a LayoutBank.
+
+    The layout index is drawn from RandomState(random_seed), so the same seed gives
+    the same sequence of layouts.
+    """
+
+    def __init__(self, bank: LayoutBank, random_seed: int):
+        self._bank = bank
+        self._random_state = np.random.RandomState(random_seed)
+        self.regenerate()
+
+    def reseed(self, random_seed: int):
+        self._random_state = np.random.RandomState(random_seed)
+
+    def regenerate(self):
+        index = self._random_state.randint(len(self._bank))
+        self._entity_layer, self._variations_layer = self._bank[index]
+
+    @property
+    def entity_layer(self) -> np.ndarray:
+        return self._entity_layer
+
+    @property
+    def variations_layer(self) -> np.ndarray:
+        return self._variations_layer
+
+    @property
+    def height(self) -> int:
+        return self._bank.height
+
+    @property
+    def width(self) -> int:
+        return self._bank.width
+
+
+def generate_layout_bank(
+    path: Union[str, Path],
+    n_layouts: int,
+    maze_size: int,
+    max_rooms: int = 6,
+    room_min_size: int = 3,
+    room_max_size: int = 5,
+    min_targets: int = 3,
+    seed: int = 0,
+    chunk_size: int = 10000,
+    workers: int = 1,
+):
+    """Generates layouts in chunks, where chunk i is generated from seed (seed, i)."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    maze_kwargs = dict(
+        height=maze_size + 2,  # inner size => outer size, as in tasks._memory_maze()
+        width=maze_size + 2,
+        max_rooms=max_rooms,
+        room_min_size=room_min_size,
+        room_max_size=room_max_size,
+        max_variations=26,
+        spawns_per_room=1,
+        objects_per_room=1,
+        simplify=True,
+    )
+    n_chunks = (n_layouts + chunk_size - 1) // chunk_size
+    shape = (n_layouts, maze_kwargs['height'], maze_kwargs['width'])
+    entity_layer = np.lib.format.open_memmap(path / ENTITY_FILE, mode='w+', dtype=np.uint8, shape=shape)
+    variations_layer = np.lib.format.open_memmap(path / VARIATIONS_FILE, mode='w+', dtype=np.uint8, shape=shape)
+
+    chunks = [(maze_kwargs, min_targets, _chunk_seed(seed, i), min(chunk_size, n_layouts - i * chunk_size)) for i in range(n_chunks)]
+    start = time.time()
+    with mp.get_context('spawn').Pool(workers) as pool:
+        for i, (entity, variations) in enumerate(pool.imap(_generate_chunk, chunks)):
+            entity_layer[i * chunk_size:i * chunk_size + len(entity)] = entity
+            variations_layer[i * chunk_size:i * chunk_size + len(variations)] = variations
+            done = min((i + 1) * chunk_size, n_layouts)
+            print(f'Generated {done}/{n_layouts} layouts ({done / (time.time() - start):.0f}/s)')
+    entity_layer.flush()
+    variations_layer.flush()
+
+    meta = dict(maze_kwargs, min_targets=min_targets, seed=seed, chunk_size=chunk_size, n_layouts=n_layouts)
+    (path / META_FILE).write_text(json.dumps(meta, indent=2))
+
+
+def _chunk_seed(seed, chunk):
+    return int(np.random.SeedSequence([seed, chunk]).generate_state(1)[0] % 2147483647) + 1
+
+
+def _generate_chunk(args):
+    maze_kwargs, min_targets, random_seed, n = args
+    maze = TextMazeVaryingWalls(random_seed=random_seed, **maze_kwargs)
+    entity = np.zeros((n, maze_kwargs['height'], maze_kwargs['width']), np.uint8)
+    variations = np.zeros_like(entity)
+    i = 0
+    while i < n:
+        maze.regenerate()
+        if np.sum(maze.entity_layer == 'G') < min_targets:
+            continue  # Same condition as MemoryMazeTask._place_targets() failing
+        entity[i] = _to_bytes(maze.entity_layer)
+        variations[i] = _to_bytes(maze.variations_layer)
+        i += 1
+    return entity, variations
+
+
+def _to_bytes(layer: np.ndarray) -> np.ndarray:
+    return np.asarray(layer).astype('S1').view(np.uint8)
+
+
+def _to_chars(layer: np.ndarray) -> np.ndarray:
+    return np.asarray(layer).view('S1').astype('U1')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('-n', '--n_layouts', type=int, default=1000000)
+    parser.add_argument('--maze-size', type=int, default=9)
+    parser.add_argument('--max-rooms', type=int, default=6)
+    parser.add_argument('--room-min-size', type=int, default=3)
+    parser.add_argument('--room-max-size', type=int, default=5)
+    parser.add_argument('--min-targets', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=mp.cpu_count())
+    args = parser.parse_args()
+    generate_layout_bank(
+        args.path,
+        args.n_layouts,
+        maze_size=args.maze_size,
+        max_rooms=args.max_rooms,
+        room_min_size=args.room_min_size,
+        room_max_size=args.room_max_size,
+        min_targets=args.min_targets,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,58 @@
-from typing import Optional
+from typing import Dict, Optional
+import collections
 import functools
+import pickle
 import string
 
+import dm_env
 import labmaze
+import mujoco
 import numpy as np
-from dm_control import mjcf
+from absl import logging
+from dm_control import composer, mjcf
 from dm_control.composer.observation import observable as observable_lib
 from dm_control.locomotion.arenas import covering, labmaze_textures, mazes
 from dm_control.locomotion.props import target_sphere
 from dm_control.locomotion.tasks import random_goal_maze
 from dm_control.locomotion.walkers import jumping_ball
+from dm_control.rl import control
 from labmaze import assets as labmaze_assets
+from labmaze import text_grid
 from numpy.random import RandomState
 
 DEFAULT_CONTROL_TIMESTEP = 0.025
 DEFAULT_PHYSICS_TIMESTEP = 0.005
 
+# Physics timestep and MuJoCo <option> overrides, selected by physics_profile in tasks.py.
+# 'fast' is validated against 'default' with `python -m memory_maze.physics_check`:
+# 20 instead of 50 substeps per 4Hz control step, and no noslip pass (the walker's joint
+# damping already stops it sliding), 2.5-3x faster with the same target and wall contact
+# outcomes of each step. Larger timesteps make contacts softer (MuJoCo clamps the contact
+# time constant to 2x timestep) and the per-step error grows quickly.
+PHYSICS_PROFILES = {
+    'default': dict(timestep=DEFAULT_PHYSICS_TIMESTEP, options={}),
+    'fast': dict(timestep=0.0125, options=dict(noslip_iterations=0)),
+}
+
+_WALL_GEOM_GROUP = 3  # As in dm_control mazes, hidden in default render options
+_DISABLED_GEOM_GROUP = 5  # Unused pooled geoms, also hidden
+_UNUSED_GEOM_POS = np.array([0.0, 0.0, -100.0])  # Below the floor, out of the way of spawn raycasts
+_UNUSED_BOX_SIZE = np.array([0.01, 0.01, 0.01])
+_PLANE_PIECES = (1, 3, 9)  # Lengths in cells of pooled texturing planes
+
+# Orientation of wall texturing planes, as in mazes.MazeWithTargets._make_wall_texturing_planes()
+_TEXTURING_PLANE_AXES = {
+    'x': {-1: [0, -1, 0, 0, 0, 1], 1: [0, 1, 0, 0, 0, 1]},
+    'y': {-1: [1, 0, 0, 0, 0, 1], 1: [-1, 0, 0, 0, 0, 1]},
+    'z': {1: [1, 0, 0, 0, 1, 0]},  # No texturing plane at the bottom
+}
+
+# Independent random streams of an episode, see MemoryMazeEnvironment.reset(episode_index)
+EPISODE_STREAMS = ['layout', 'texture', 'target', 'color', 'spawn', 'env']
+
+# Physics state in snapshots: time, qpos, qvel, act, solver warmstart, controls and applied forces
+_PHYSICS_STATE = mujoco.mjtState.mjSTATE_INTEGRATION
+
 TARGET_COLORS = [
     np.array([170, 38, 30]) / 220,  # red
     np.array([99, 170, 88]) / 220,  # green
@@ -74,6 +111,8 @@ class MemoryMazeTask(random_goal_maze.NullGoalMaze):
         self._current_target_ix = 0
         self._rewarded_this_step = False
         self._targets_obtained = 0
+        self._layout_pending = False  # Generated in fast_reset mode, but not yet applied
+        self._streams: Optional[Dict[str, RandomState]] = None
 
         if enable_global_task_observables:
             # Add egocentric vectors to targets
@@ -116,26 +155,60 @@ class MemoryMazeTask(random_goal_maze.NullGoalMaze):
     def task_observables(self):
         return self._task_observables
 
+    @property
+    def walker(self):
+        return self._walker
+
     @property
     def name(self):
         return 'memory_maze'
 
+    def seed_episode(self, seeds: Optional[Dict[str, int]]):
+        """Draws the layout, wall textures, targets, target colors and spawn of the next episode
+        from separate seeds, instead of the env RandomState (seeds=None)."""
+        if seeds is None:
+            self._streams = None
+            return
+        self._maze_arena.maze.reseed(seeds['layout'])
+        self._streams = {name: RandomState(seeds[name]) for name in ['texture', 'target', 'color', 'spawn']}
+
+    def _stream(self, name: str, rng: RandomState) -> RandomState:
+        return self._streams[name] if self._streams is not None else rng
+
     def initialize_episode_mjcf(self, rng: RandomState):
-        self._maze_arena.regenerate(rng)  # Bypass super()._initialize_episode_mjcf(), because it ignores rng
+        if self._maze_arena.fast_reset:
+            return  # The layout is applied to the compiled model in initialize_episode()
+        self._maze_arena.regenerate(self._stream('texture', rng))  # Bypass super()._initialize_episode_mjcf(), because it ignores rng
+        if self._streams is not None:
+            self._target_colors = list(TARGET_COLORS)  # Colors are shuffled in place, start from the same order
         while True:
             if self._target_randomize_colors:
                 # Recreate target objects with new colors
-                self._create_targets(clear_existing=True, randomize_colors=True, rng=rng)
-            ok = self._place_targets(rng)
+                self._create_targets(clear_existing=True, randomize_colors=True, rng=self._stream('color', rng))
+            ok = self._place_targets(self._stream('target', rng))
             if not ok:
                 # Could not place targets - regenerate the maze
-                self._maze_arena.regenerate(rng)
+                self._maze_arena.regenerate(self._stream('texture', rng))
                 continue
             break
-        self._pick_new_target(rng)
+        self._pick_new_target(self._stream('target', rng))
 
     def initialize_episode(self, physics, rng: RandomState):
-        super().initialize_episode(physics, rng)
+        if self._maze_arena.fast_reset:
+            # Same as initialize_episode_mjcf(), but edits the compiled model in place, without recompiling
+            for target in self._targets:
+                target.reset(physics)  # Done by target.initialize_episode_mjcf() otherwise
+            if not self._layout_pending:
+                self._maze_arena.regenerate(self._stream('texture', rng))
+                while not self._place_targets(self._stream('target', rng), physics):
+                    self._maze_arena.regenerate(self._stream('texture', rng))
+            # If the geom pool is too small, the environment recompiles it and this is called again
+            self._layout_pending = True
+            self._maze_arena.apply_geom_pool(physics)
+            self._layout_pending = False
+            physics.forward()  # Update geom_xpos of moved walls, which spawn raycasts use
+            self._pick_new_target(self._stream('target', rng))
+        super().initialize_episode(physics, self._stream('spawn', rng))
         self._rewarded_this_step = False
         self._targets_obtained = 0
 
@@ -147,7 +220,7 @@ class MemoryMazeTask(random_goal_maze.NullGoalMaze):
                 if i == self._current_target_ix:
                     self._rewarded_this_step = True
                     self._targets_obtained += 1
-                    self._pick_new_target(rng)
+                    self._pick_new_target(self._stream('target', rng))
                 target.reset(physics)  # Resets activated=False
 
     def should_terminate_episode(self, physics):
@@ -158,6 +231,56 @@ class MemoryMazeTask(random_goal_maze.NullGoalMaze):
             return self._target_reward_scale
         return 0.0
 
+    def get_layout(self) -> dict:
+        """Maze layout, wall textures, target positions and colors, i.e. everything compiled into the model."""
+        layout = self._maze_arena.get_layout()
+        layout['target_positions'] = np.array([mjcf.get_attachment_frame(target.mjcf_model).pos for target in self._targets])
+        layout['target_colors'] = np.array(self._target_colors)
+        return layout
+
+    def set_layout(self, layout: dict, physics=None):
+        """Restores get_layout(). In fast_reset mode the compiled model is edited in place,
+        otherwise the model must be recompiled."""
+        self._maze_arena.set_layout(layout)
+        if not np.array_equal(layout['target_colors'], self._target_colors):
+            self._target_colors = list(layout['target_colors'])
+            self._create_targets(clear_existing=True)
+        for target, pos in zip(self._targets, layout['target_positions']):
+            mjcf.get_attachment_frame(target.mjcf_model).pos = pos
+            if physics is not None:
+                target.set_pose(physics, position=pos)
+        if physics is not None:
+            self._maze_arena.apply_geom_pool(physics)
+
+    def get_episode_state(self) -> dict:
+        return {
+            'current_target_ix': self._current_target_ix,
+            'targets_obtained': self._targets_obtained,
+            'rewarded_this_step': self._rewarded_this_step,
+            'discount': self._discount,
+            'failure_termination': getattr(self, '_failure_termination', False),  # Set by the first after_step()
+            'activated': [target.activated for target in self._targets],
+            'streams': {name: stream.get_state() for name, stream in self._streams.items()} if self._streams is not None else None,
+        }
+
+    def set_episode_state(self, physics, state: dict):
+        self._current_target_ix = state['current_target_ix']
+        self._targets_obtained = state['targets_obtained']
+        self._rewarded_this_step = state['rewarded_this_step']
+        self._discount = state['discount']
+        self._failure_termination = state['failure_termination']
+        if state['streams'] is None:
+            self._streams = None
+        else:
+            self._streams = {name: RandomState() for name in state['streams']}
+            for name, stream_state in state['streams'].items():
+                self._streams[name].set_state(stream_state)
+        for target, activated in zip(self._targets, state['activated']):
+            # TargetSphere keeps these in private attributes, set by initialize_episode() and after_substep()
+            target._geom_id = physics.model.name2id(target.geom.full_identifier, 'geom')
+            target._activated = activated
+            physics.bind(target.material).rgba[-1] = 0 if activated else 1
+
     def _create_targets(self, clear_existing=False, randomize_colors=False, rng: Optional[RandomState] = None):
         if clear_existing:
             while self._targets:
@@ -181,7 +304,7 @@ class MemoryMazeTask(random_goal_maze.NullGoalMaze):
             self._targets.append(target)
             self._maze_arena.attach(target)
 
-    def _place_targets(self, rng: RandomState) -> bool:
+    def _place_targets(self, rng: RandomState, physics=None) -> bool:
         possible_positions = list(self._maze_arena.target_positions)
         rng.shuffle(possible_positions)
         if len(possible_positions) < len(self._targets):
@@ -189,6 +312,8 @@ class MemoryMazeTask(random_goal_maze.NullGoalMaze):
             return False
         for target, pos in zip(self._targets, possible_positions):
             mjcf.get_attachment_frame(target.mjcf_model).pos = pos
+            if physics is not None:
+                target.set_pose(physics, position=pos)  # Update compiled model in fast_reset mode
         return True
 
     def _pick_new_target(self, rng: RandomState):
@@ -200,6 +325,158 @@ class MemoryMazeTask(random_goal_maze.NullGoalMaze):
             break
 
 
+class GeomPoolFull(Exception):
+    """The layout needs more pooled geoms than were compiled, see MazeWithTargetsArena.apply_geom_pool()."""
+
+
+class MemoryMazeEnvironment(composer.Environment):
+    """composer.Environment with action repeat and per-episode seeding.
+
+    Each step() repeats the action for up to action_repeat control steps, summing the reward,
+    and stops early when a target is collected or the episode ends. Observations (including
+    camera rendering) are only computed for the final state.
+    """
+
+    def __init__(self, *args, action_repeat: int = 1, seed: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._action_repeat = action_repeat
+        self._seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self._episode_index: Optional[int] = None
+        self._layout = None  # Pickled task.get_layout() of the current episode, computed on demand
+
+    @property
+    def episode_index(self) -> Optional[int]:
+        return self._episode_index
+
+    def reset(self, episode_index: Optional[int] = None, seed: Optional[int] = None):
+        """Starts a new episode.
+
+        With episode_index=k the episode depends only on (seed, k): the layout, wall textures,
+        targets, target colors, spawn and the env RandomState are drawn from independent streams
+        derived from it, so any episode can be regenerated without replaying the ones before.
+        After an indexed episode, reset() without an index (including the automatic reset in
+        step()) continues with k+1. Passing seed replaces the seed given to the constructor,
+        and starts from episode_index=0 unless specified, as in Gymnasium's reset(seed).
+        """
+        if seed is not None:
+            self._seed = seed
+            if episode_index is None:
+                episode_index = 0
+        if episode_index is None and self._episode_index is not None:
+            episode_index = self._episode_index + 1
+        if episode_index is not None:
+            seeds = dict(zip(EPISODE_STREAMS, np.random.SeedSequence([self._seed, episode_index]).generate_state(len(EPISODE_STREAMS))))
+            self._task.seed_episode({name: int(seed) for name, seed in seeds.items()})
+            self._random_state.seed(seeds['env'])
+        self._episode_index = episode_index
+        self._layout = None
+        try:
+            return super().reset()
+        except GeomPoolFull:
+            # fast_reset mode, when the layout needs more pooled geoms: recompile and apply it again
+            self._recompile_physics_and_update_observables()
+            return super().reset()
+
+    def snapshot(self) -> bytes:
+        """Captures the state of the episode: physics, task, maze layout and targets, and the RandomState.
+
+        The maze generator (labmaze or layout bank) has its own random state, which is not
+        captured, so episodes after the current one may have different layouts after restore(),
+        unless they are seeded with reset(episode_index).
+        """
+        if self._mjcf_never_compiled:
+            raise RuntimeError('reset() must be called before snapshot()')
+        return pickle.dumps({
+            'layout': self._current_layout(),
+            'physics': self._physics.get_state(_PHYSICS_STATE),
+            'task': self._task.get_episode_state(),
+            'random_state': self._random_state.get_state(),
+            'reset_next_step': self._reset_next_step,
+            'episode_index': self._episode_index,
+        }, pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, snapshot: bytes):
+        """Restores a snapshot() of this environment, or of another with the same arguments.
+
+        If the layout is the same as in the current episode, only the state is set. Otherwise the
+        model is recompiled, or edited in place in fast_reset mode. The next step() continues
+        from the restored state, as it would have after the snapshot.
+        """
+        state = pickle.loads(snapshot)
+        if self._mjcf_never_compiled or state['layout'] != self._current_layout():
+            layout = pickle.loads(state['layout'])
+            if self._task._maze_arena.fast_reset:
+                try:
+                    self._task.set_layout(layout, self._physics_proxy)
+                except GeomPoolFull:
+                    self._recompile_physics_and_update_observables()
+                    self._task.set_layout(layout, self._physics_proxy)
+            else:
+                self._task.set_layout(layout)
+                self._recompile_physics_and_update_observables()
+            self._layout = state['layout']
+            self._mjcf_never_compiled = False
+        self._physics.set_state(state['physics'], _PHYSICS_STATE)
+        self._physics.forward()  # Positions of bodies and contacts, for observables and target activation
+        self._task.set_episode_state(self._physics_proxy, state['task'])
+        self._random_state.set_state(state['random_state'])
+        self._reset_next_step = state['reset_next_step']
+        self._episode_index = state['episode_index']
+
+    def _current_layout(self) -> bytes:
+        if self._layout is None:
+            self._layout = pickle.dumps(self._task.get_layout(), pickle.HIGHEST_PROTOCOL)
+        return self._layout
+
+    def step(self, action):
+        if self._action_repeat == 1 or self._reset_next_step:
+            return super().step(action)
+
+        # Fork of composer.Environment.step(), looping over control steps
+        reward = 0.0
+        for _ in range(self._action_repeat):
+            self._hooks.before_step(self._physics_proxy, action, self._random_state)
+            try:
+                for _ in range(self._n_sub_steps):
+                    self._substep(action)
+                physics_is_divergent = False
+            except control.PhysicsError as e:
+                if not self._raise_exception_on_physics_error:
+                    logging.warning(e)
+                    physics_is_divergent = True
+                else:
+                    raise
+            self._hooks.after_step(self._physics_proxy, self._random_state)
+
+            if not physics_is_divergent:
+                step_reward = self._task.get_reward(self._physics_proxy)
+                discount = self._task.get_discount(self._physics_proxy)
+                terminating = (
+                    self._task.should_terminate_episode(self._physics_proxy)
+                    or self._physics.time() >= self._time_limit
+                )
+            else:
+                step_reward = 0.0
+                discount = 0.0
+                terminating = True
+            reward += step_reward
+            if terminating or step_reward:
+                break
+
+        # PATCH: observation updates only for the last control step. With the default update
+        # schedule (every physics step, buffer size 1) only the final update() evaluates observables.
+        self._observation_updater.prepare_for_next_control_step()
+        for _ in range(self._n_sub_steps):
+            self._observation_updater.update()
+        obs = self._observation_updater.get_observation()
+
+        if not terminating:
+            return dm_env.TimeStep(dm_env.StepType.MID, reward, discount, obs)
+        else:
+            self._reset_next_step = True
+            return dm_env.TimeStep(dm_env.StepType.LAST, reward, discount, obs)
+
+
 class FixedWallTexture(labmaze_textures.WallTextures):
     """Selects a single texture instead of a collection to sample from."""
 
@@ -253,20 +530,29 @@ class MazeWithTargetsArena(mazes.MazeWithTargets):
                floor_textures=None,
                aesthetic='default',
                name='random_maze',
-               random_seed=None):
+               random_seed=None,
+               layout_bank=None,
+               fast_reset=False):
         assert random_seed, "Expected to be set by tasks._memory_maze()"
+        maze_kwargs = dict(
+            height=y_cells,
+            width=x_cells,
+            max_rooms=max_rooms,
+            room_min_size=room_min_size,
+            room_max_size=room_max_size,
+            max_variations=max_variations,
+            spawns_per_room=spawns_per_room,
+            objects_per_room=targets_per_room,
+            simplify=simplify)
+        if layout_bank is not None:
+            # Draw pre-generated layouts instead of running labmaze generator on reset
+            from memory_maze.layout_bank import LayoutBankMaze
+            layout_bank.check_compatible(**maze_kwargs)
+            maze = LayoutBankMaze(layout_bank, random_seed=random_seed)
+        else:
+            maze = TextMazeVaryingWalls(random_seed=random_seed, **maze_kwargs)
         super()._build(
-            maze=TextMazeVaryingWalls(
-                height=y_cells,
-                width=x_cells,
-                max_rooms=max_rooms,
-                room_min_size=room_min_size,
-                room_max_size=room_max_size,
-                max_variations=max_variations,
-                spawns_per_room=spawns_per_room,
-                objects_per_room=targets_per_room,
-                simplify=simplify,
-                random_seed=random_seed),
+            maze=maze,
             xy_scale=xy_scale,
             z_height=z_height,
             skybox_texture=skybox_texture,
@@ -274,11 +560,16 @@ class MazeWithTargetsArena(mazes.MazeWithTargets):
             floor_textures=floor_textures,
             aesthetic=aesthetic,
             name=name)
+        self._fast_reset = fast_reset
+        if fast_reset:
+            self._build_geom_pool()
 
     def regenerate(self, random_state):
         """Generates a new maze layout.
 
         Patch of MazeWithTargets.regenerate() which uses random_state.
+        In fast_reset mode only the text maze is regenerated, and apply_geom_pool()
+        must be called to update the compiled model.
         """
         self._maze.regenerate()
         # logging.debug('GENERATED MAZE:\n%s', self._maze.entity_layer)
@@ -287,33 +578,287 @@ class MazeWithTargetsArena(mazes.MazeWithTargets):
         if self._text_maze_regenerated_hook:
             self._text_maze_regenerated_hook()
 
-        # Remove old texturing planes.
-        for geom_name in self._texturing_geom_names:
-            del self._mjcf_root.worldbody.geom[geom_name]
-        self._texturing_geom_names = []
-
-        # Remove old texturing materials.
-        for material_name in self._texturing_material_names:
-            del self._mjcf_root.asset.material[material_name]
-        self._texturing_material_names = []
-
-        # Remove old actual-wall geoms.
-        self._maze_body.geom.clear()
-
-        self._current_wall_texture = {
+        self._build_layout({
             wall_char: random_state.choice(wall_textures)  # PATCH: use random_state for wall textures
             for wall_char, wall_textures in self._wall_textures.items()
+        })
+
+    def get_layout(self) -> dict:
+        """Text maze layers and wall textures of the current layout."""
+        return {
+            'entity_layer': _grid_string(self._maze.entity_layer),
+            'variations_layer': _grid_string(self._maze.variations_layer),
+            'wall_textures': {wall_char: wall_textures.index(self._current_wall_texture[wall_char])
+                              for wall_char, wall_textures in self._wall_textures.items()},
         }
 
+    def set_layout(self, layout: dict):
+        """Restores get_layout(), without running the maze generator.
+
+        As in regenerate(), apply_geom_pool() must be called in fast_reset mode.
+        """
+        # Both TextMazeVaryingWalls (labmaze.RandomMaze) and LayoutBankMaze keep the layers in these
+        self._maze._entity_layer = text_grid.TextGrid(layout['entity_layer'])
+        self._maze._variations_layer = text_grid.TextGrid(layout['variations_layer'])
+        self._find_spawn_and_target_positions()
+        self._build_layout({
+            wall_char: self._wall_textures[wall_char][index]
+            for wall_char, index in layout['wall_textures'].items()
+        })
+
+    def _build_layout(self, wall_textures):
+        if not self._fast_reset:
+            # Remove old texturing planes.
+            for geom_name in self._texturing_geom_names:
+                del self._mjcf_root.worldbody.geom[geom_name]
+            self._texturing_geom_names = []
+
+            # Remove old texturing materials.
+            for material_name in self._texturing_material_names:
+                del self._mjcf_root.asset.material[material_name]
+            self._texturing_material_names = []
+
+            # Remove old actual-wall geoms.
+            self._maze_body.geom.clear()
+
+        self._current_wall_texture = wall_textures
+
+        if not self._fast_reset:
+            for wall_char in self._wall_textures:
+                self._make_wall_geoms(wall_char)
+            self._make_floor_variations()
+
+    @property
+    def fast_reset(self):
+        return self._fast_reset
+
+    def _build_geom_pool(self):
+        """Allocates wall and floor geoms, which apply_geom_pool() configures for the current layout.
+
+        Collisions use merged wall boxes as usual, which are geoms of the maze body, moved
+        and resized in place. Texturing planes can't be resized after compilation (the
+        renderer bakes their size), so they are pooled by size, and their material is
+        switched. Materials repeat textures per length (texuniform), so that one per texture
+        fits planes of all sizes. These are the same planes as without the pool, split into
+        pieces of 1, 3 or 9 cells to limit the sizes needed. The pool is sized for the initial
+        layout with a margin, and grows when a layout needs more geoms (see apply_geom_pool()).
+        """
+        self._plane_pool = {}  # Plane size in cells: [geom]
+        self._wall_pool = []
+        textures = [texture for wall_textures in self._wall_textures.values() for texture in wall_textures] + list(self._floor_textures)
+        textures = {texture.full_identifier: texture for texture in textures}
+        self._pool_materials = {
+            identifier: self._mjcf_root.asset.add(
+                'material', name=f'pool_{i}', texture=texture, texuniform=True, texrepeat=[2 / self._xy_scale] * 2)
+            for i, (identifier, texture) in enumerate(textures.items())}
+        # Bounding volumes are in the inertial frame, which is otherwise computed from the wall boxes
+        self._maze_body.add('inertial', pos=[0, 0, 0], mass=1, diaginertia=[1, 1, 1])
+        # The largest number of merged walls over 3000 sampled layouts is 39, 49, 57 and 76 for
+        # 9x9 to 15x15, about 0.27 of the grid cells.
+        self._add_wall_boxes(int(np.ceil(0.4 * self._maze.height * self._maze.width)))
+        initial_textures = {wall_char: wall_textures[0] for wall_char, wall_textures in self._wall_textures.items()}
+        counts = collections.Counter(key for key, *_ in self._texturing_planes(initial_textures))
+        for length in _PLANE_PIECES:
+            self._add_planes(('side', length), _pool_margin(counts['side', length]))
+            for other_length in _PLANE_PIECES:
+                self._add_planes(('flat', length, other_length), _pool_margin(counts['flat', length, other_length]))
+
+    def _add_wall_boxes(self, n):
+        for _ in range(n):
+            self._wall_pool.append(self._maze_body.add(
+                'geom', name=f'wall_pool_{len(self._wall_pool)}', type='box', pos=_UNUSED_GEOM_POS,
+                size=_UNUSED_BOX_SIZE, group=_WALL_GEOM_GROUP))
+        self._pool_ids = None
+
+    def _add_planes(self, key, count):
+        """Grows the pool of planes of the given size (in cells) to count."""
+        kind, *cells = key
+        if kind == 'side':
+            size = [cells[0] * self._xy_scale / 2, self._z_height / 2]
+        else:
+            size = np.array(cells) * self._xy_scale / 2
+        planes = self._plane_pool.setdefault(key, [])
+        for _ in range(count - len(planes)):
+            planes.append(self._mjcf_root.worldbody.add(
+                'geom', type='plane', name=f'{kind}_pool_{"x".join(map(str, cells))}_{len(planes)}',
+                pos=_UNUSED_GEOM_POS, size=[size[0], size[1], self._xy_scale],
+                material=next(iter(self._pool_materials.values())),
+                group=_DISABLED_GEOM_GROUP, contype=0, conaffinity=0))
+        self._pool_ids = None
+
+    def _texturing_planes(self, wall_textures):
+        """Pooled planes of the current layout, as (size in cells, pos, xyaxes, texture, tile start).
+
+        Walls get the planes of mazes.MazeWithTargets._make_wall_texturing_planes(), and the
+        floor those of _make_floor_variations(), split into pieces of _PLANE_PIECES cells.
+        """
         for wall_char in self._wall_textures:
-            self._make_wall_geoms(wall_char)
-        self._make_floor_variations()
+            texture = wall_textures[wall_char]
+            for wall_pos, wall_size in self._wall_rects(wall_char):
+                cells = np.round(2 * wall_size[:2] / self._xy_scale).astype(int)
+                for direction_index, direction in enumerate('xy'):
+                    delta_vector = np.array([int(i == direction_index) for i in range(3)])
+                    for sign, xyaxes in _TEXTURING_PLANE_AXES[direction].items():
+                        for length, offset in _plane_pieces(cells[1 - direction_index]):
+                            pos = wall_pos + sign * delta_vector * wall_size + (1 - delta_vector) * [offset, offset, 0] * self._xy_scale
+                            yield ('side', length), pos, xyaxes, texture, None
+                for key, pos in self._flat_pieces(wall_pos + [0, 0, wall_size[2]], cells):
+                    yield key, pos, _TEXTURING_PLANE_AXES['z'][1], texture, None
+        for _, tile_start, texture, tile_pos, tile_size in self._floor_tiles():
+            cells = np.round(2 * tile_size[:2] / self._xy_scale).astype(int)
+            for key, pos in self._flat_pieces(tile_pos, cells):
+                yield key, pos, _TEXTURING_PLANE_AXES['z'][1], texture, tile_start
+
+    def _flat_pieces(self, pos, cells):
+        for x_length, x_offset in _plane_pieces(cells[0]):
+            for y_length, y_offset in _plane_pieces(cells[1]):
+                yield ('flat', x_length, y_length), pos + np.array([x_offset, y_offset, 0]) * self._xy_scale
+
+    def apply_geom_pool(self, physics):
+        """Applies the current layout by editing pooled geoms in the compiled model in place.
+
+        Raises GeomPoolFull if the layout needs more geoms than were compiled. The missing
+        geoms are then added to the MJCF model, and the layout must be applied again after
+        recompiling.
+        """
+        walls = [rect for wall_char in self._wall_textures for rect in self._wall_rects(wall_char)]
+        planes = list(self._texturing_planes(self._current_wall_texture))
+        counts = collections.Counter(key for key, *_ in planes)
+        missing = [key for key, count in counts.items() if count > len(self._plane_pool.get(key, []))]
+        if len(walls) > len(self._wall_pool) or missing:
+            self._add_wall_boxes(len(walls) - len(self._wall_pool))
+            for key in missing:
+                self._add_planes(key, _pool_margin(counts[key]))
+            raise GeomPoolFull(f'Layout needs {len(walls)} wall boxes and planes of sizes {missing}')
+        if self._pool_ids is None:
+            self._pool_ids = self._bind_pool_ids(physics)
+        ids = self._pool_ids
+        model = physics.model
+
+        # Collision boxes
+        n_boxes = len(self._wall_pool)
+        wall_pos = np.tile(_UNUSED_GEOM_POS, (n_boxes, 1))
+        wall_size = np.tile(_UNUSED_BOX_SIZE, (n_boxes, 1))
+        for i, (pos, size) in enumerate(walls):
+            wall_pos[i], wall_size[i] = pos, size
+        self._update_wall_bvh(model, wall_pos, wall_size)
+        # Rendering scales clipping planes, shadows and fog by the model extent, which the compiler
+        # computes from the bounding spheres of geoms, as without the pool the walls span them
+        wall_rbound = np.linalg.norm(wall_size[:len(walls), None], axis=-1)
+        low = (wall_pos[:len(walls)] - wall_rbound).min(axis=0)
+        high = (wall_pos[:len(walls)] + wall_rbound).max(axis=0)
+        model.stat.center = (low + high) / 2
+        model.stat.extent = np.max(high - low)
+
+        # Texturing planes
+        geoms, plane_pos, plane_quat, material_ids = [], [], [], []
+        used = collections.Counter()
+        self._tile_geom_names = {}
+        for key, pos, xyaxes, texture, tile_start in planes:
+            geoms.append(ids['plane'][key][used[key]])
+            plane_pos.append(pos)
+            plane_quat.append(ids['quat'][tuple(xyaxes)])
+            material_ids.append(ids['material'][texture.full_identifier])
+            if tile_start is not None and tile_start not in self._tile_geom_names:
+                self._tile_geom_names[tile_start] = self._plane_pool[key][used[key]].name
+            used[key] += 1
+        model.geom_pos[ids['all_planes']] = _UNUSED_GEOM_POS  # Also out of the way of spawn raycasts
+        model.geom_group[ids['all_planes']] = _DISABLED_GEOM_GROUP
+        model.geom_pos[geoms] = plane_pos
+        model.geom_quat[geoms] = plane_quat
+        model.geom_group[geoms] = 0
+        model.geom_matid[geoms] = material_ids
+
+    def _update_wall_bvh(self, model, wall_pos, wall_size):
+        """Moves wall boxes into the leaves of the compiled bounding volume hierarchy of the
+        maze body and refreshes its bounding boxes, so the midphase stays valid.
+
+        The leaves are the pooled boxes. Each node splits its walls along the axis in which
+        their centers spread most, so subtrees stay compact as for a freshly compiled tree.
+        """
+        bvh = self._pool_ids['bvh']
+        aabb = np.zeros((len(bvh['child']), 6))
+        leaf_walls = np.zeros(len(bvh['child']), int)
+
+        def assign(node, walls):
+            left, right = bvh['child'][node]
+            if left < 0:
+                leaf_walls[node] = walls[0]
+                aabb[node] = np.concatenate([wall_pos[walls[0]], wall_size[walls[0]]])
+                return
+            spread = np.ptp(wall_pos[walls], axis=0)
+            walls = walls[np.argsort(wall_pos[walls, np.argmax(spread)], kind='stable')]
+            assign(left, walls[:bvh['leaves'][left]])
+            assign(right, walls[bvh['leaves'][left]:])
+            low = np.minimum(aabb[left, :3] - aabb[left, 3:], aabb[right, :3] - aabb[right, 3:])
+            high = np.maximum(aabb[left, :3] + aabb[left, 3:], aabb[right, :3] + aabb[right, 3:])
+            aabb[node] = np.concatenate([(low + high) / 2, (high - low) / 2])
+
+        assign(0, np.arange(len(wall_pos)))
+        leaves = bvh['leaf']
+        geoms = bvh['geom'][leaves]
+        model.geom_pos[geoms] = wall_pos[leaf_walls[leaves]]
+        model.geom_size[geoms] = wall_size[leaf_walls[leaves]]
+        model.geom_aabb[geoms, 3:] = wall_size[leaf_walls[leaves]]
+        model.geom_rbound[geoms] = np.linalg.norm(wall_size[leaf_walls[leaves]], axis=1)
+        model.bvh_aabb[bvh['adr']:bvh['adr'] + len(aabb)] = aabb
+
+    def _bind_pool_ids(self, physics):
+        def element_ids(elements):
+            return np.array(physics.bind(elements).element_id)
+
+        model = physics.model
+        body = physics.bind(self._maze_body).element_id
+        assert not model.body_ipos[body].any() and model.body_iquat[body, 0] == 1, 'Inertial frame must be the body frame'
+        adr, num = model.body_bvhadr[body], model.body_bvhnum[body]
+        child = model.bvh_child[adr:adr + num].reshape((num, 2))  # Relative to adr, -1 at leaves
+        geom = model.bvh_nodeid[adr:adr + num]
+        assert sorted(geom[child[:, 0] < 0]) == sorted(element_ids(self._wall_pool)), 'Unexpected geoms in maze body'
+        leaves = np.zeros(num, int)
+        for node in reversed(range(num)):  # Children are stored after their parent
+            leaves[node] = 1 if child[node, 0] < 0 else leaves[child[node, 0]] + leaves[child[node, 1]]
+        all_planes = element_ids([geom for planes in self._plane_pool.values() for geom in planes])
+        model.geom_sameframe[all_planes] = mujoco.mjtSameFrame.mjSAMEFRAME_NONE  # Else geom_quat is ignored
+        return {
+            'bvh': {'adr': adr, 'child': child, 'geom': geom, 'leaves': leaves, 'leaf': np.flatnonzero(child[:, 0] < 0)},
+            'plane': {key: element_ids(planes) for key, planes in self._plane_pool.items()},
+            'all_planes': all_planes,
+            'material': dict(zip(self._pool_materials, element_ids(list(self._pool_materials.values())))),
+            'quat': {tuple(xyaxes): _xyaxes_quat(xyaxes) for signs in _TEXTURING_PLANE_AXES.values() for xyaxes in signs.values()},
+        }
+
+    def _wall_rects(self, wall_char):
+        """Positions and sizes of wall boxes, as in mazes.MazeWithTargets._make_wall_geoms()."""
+        walls = covering.make_walls(self._maze.entity_layer, wall_char=wall_char, make_odd_sized_walls=True)
+        for wall in walls:
+            wall_mid = covering.GridCoordinates(
+                (wall.start.y + wall.end.y - 1) / 2,
+                (wall.start.x + wall.end.x - 1) / 2)
+            wall_pos = np.array([(wall_mid.x - self._x_offset) * self._xy_scale,
+                                 -(wall_mid.y - self._y_offset) * self._xy_scale,
+                                 self._z_height / 2])
+            wall_size = np.array([(wall.end.x - wall_mid.x - 0.5) * self._xy_scale,
+                                  (wall.end.y - wall_mid.y - 0.5) * self._xy_scale,
+                                  self._z_height / 2])
+            yield wall_pos, wall_size
 
     def _make_floor_variations(self, build_tile_geoms_fn=None):
         """Fork of mazes.MazeWithTargets._make_floor_variations().
 
         Makes the room floors different if possible, instead of sampling randomly.
         """
+        for tile_name, tile_start, variation_texture, tile_pos, tile_size in self._floor_tiles(build_tile_geoms_fn):
+            self._tile_geom_names[tile_start] = tile_name
+            self._texturing_material_names.append(tile_name)
+            self._texturing_geom_names.append(tile_name)
+            material = self._mjcf_root.asset.add(
+                'material', name=tile_name, texture=variation_texture,
+                texrepeat=(2 * tile_size[[0, 1]] / self._xy_scale))
+            self._mjcf_root.worldbody.add(
+                'geom', name=tile_name, type='plane', material=material,
+                pos=tile_pos, size=tile_size, contype=0, conaffinity=0)
+
+    def _floor_tiles(self, build_tile_geoms_fn=None):
         _DEFAULT_FLOOR_CHAR = '.'
 
         main_floor_texture = self._floor_textures[0]
@@ -353,20 +898,51 @@ class MazeWithTargetsArena(mazes.MazeWithTargets):
                     tile_name = 'floor_{}'.format(i)
                 else:
                     tile_name = 'floor_{}_{}'.format(variation, i)
-                self._tile_geom_names[tile.start] = tile_name
-                self._texturing_material_names.append(tile_name)
-                self._texturing_geom_names.append(tile_name)
-                material = self._mjcf_root.asset.add(
-                    'material', name=tile_name, texture=variation_texture,
-                    texrepeat=(2 * tile_size[[0, 1]] / self._xy_scale))
-                self._mjcf_root.worldbody.add(
-                    'geom', name=tile_name, type='plane', material=material,
-                    pos=tile_pos, size=tile_size, contype=0, conaffinity=0)
+                yield tile_name, tile.start, variation_texture, tile_pos, tile_size
+
+
+def _plane_pieces(cells: int):
+    """Splits a row of cells into pieces of _PLANE_PIECES cells, as (length, center offset in cells).
+
+    Odd lengths keep pieces centered on cells, so that textures are aligned as on the whole row.
+    """
+    start = -cells / 2
+    for length in sorted(_PLANE_PIECES, reverse=True):
+        while start + length <= cells / 2:
+            yield length, start + length / 2
+            start += length
+
+
+def _pool_margin(count: int) -> int:
+    # Piece counts vary between layouts roughly like sqrt(count); every pooled geom, used or not,
+    # also adds to the scene that dm_control allocates on each render
+    return int(np.ceil(count + 3 * np.sqrt(count))) + 2
+
+
+def _xyaxes_quat(xyaxes) -> np.ndarray:
+    x, y = np.array(xyaxes[:3], float), np.array(xyaxes[3:], float)
+    quat = np.zeros(4)
+    mujoco.mju_mat2Quat(quat, np.stack([x, y, np.cross(x, y)], axis=1).ravel())
+    return quat
+
+
+def _grid_string(grid: np.ndarray) -> str:
+    """Newline-terminated rows, as accepted by labmaze TextGrid."""
+    return ''.join(''.join(row) + '\n' for row in grid)
 
 
 class TextMazeVaryingWalls(labmaze.RandomMaze):
     """Augments standard generated labmaze with some walls marked with different chars."""
 
+    def __init__(self, random_seed=None, **kwargs):
+        super().__init__(random_seed=random_seed, **kwargs)
+        self._maze_kwargs = kwargs
+
+    def reseed(self, random_seed: int):
+        """Restarts the labmaze generator, which has no seed() of its own, from random_seed."""
+        random_seed %= 2147483648  # labmaze takes an int32 seed
+        self._native_maze = labmaze.RandomMaze(random_seed=random_seed, **self._maze_kwargs)._native_maze
+
     def regenerate(self):
         super().regenerate()
         self._block_variations()
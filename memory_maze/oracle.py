@@ -1,12 +1,25 @@
+import functools
+import math
 from collections import deque
 from typing import List, Optional, Tuple
+
+import dm_env
 import numpy as np
 
+from memory_maze.tasks import FORWARD, FORWARD_LEFT, FORWARD_RIGHT, LEFT, RIGHT
 from memory_maze.wrappers import ObservationWrapper
 
 
 class PathToTargetWrapper(ObservationWrapper):
-    """Find shortest path to target and indicate it on maze_layout. Used for Oracle."""
+    """Find shortest path to target and indicate it on maze_layout. Used for Oracle.
+
+    Distance fields to each target are computed once per episode, so finding the path
+    on each step only follows the next-hop map.
+    """
+
+    def __init__(self, env):
+        super().__init__(env)
+        self._fields = {}
 
     def observation_spec(self):
         spec = self.env.observation_spec()
@@ -16,21 +29,54 @@ class PathToTargetWrapper(ObservationWrapper):
         assert 'maze_layout' in spec
         return spec
 
+    def reset(self, **kwargs) -> dm_env.TimeStep:
+        self._fields = {}  # Maze and targets change only on reset
+        return super().reset(**kwargs)
+
+    def restore(self, snapshot: bytes):
+        self._fields = {}  # Snapshot may be from another episode
+        super().restore(snapshot)
+
+    def step(self, action) -> dm_env.TimeStep:
+        ts = self.env.step(action)
+        if ts.first():
+            self._fields = {}  # Underlying env was auto-reset
+        return dm_env.TimeStep(ts.step_type, ts.reward, ts.discount, self.observation(ts.observation))
+
     def observation(self, obs):
         assert isinstance(obs, dict)
         # Find shortest path (in gridworld) from agent to target
-        maze = obs['maze_layout']
+        maze = obs['maze_layout']  # Read-only, shared by all steps of the episode
         start = tuple(obs['agent_pos'].astype(int))
         finish = tuple(obs['target_pos'].astype(int))
-        path = breadth_first_search(maze, start, finish)
+        field = self._fields.get(finish)
+        if field is None:
+            field = self._fields[finish] = DistanceField(maze, finish)
+        path = field.path(start)
         if path:
+            maze = obs['maze_layout'] = maze.copy()  # Overlay path on a copy of maze_layout
             for x, y in path:
-                maze[y, x] = 2  # Update maze_layout observation
+                maze[y, x] = 2
         return obs
 
 
 class DrawMinimapWrapper(ObservationWrapper):
-    """Show maze_layout as minimap in image observation. Used for Oracle."""
+    """Show maze_layout as minimap in image observation. Used for Oracle.
+
+    The map is drawn with nearest-neighbour index tables, which reproduce PIL
+    resize(), transform() and rotate() (resample=NEAREST) pixel-exactly.
+    """
+
+    def __init__(self, env):
+        super().__init__(env)
+        # Walls in black, corridors in white, path in green, agent in red.
+        # Halved for blending, and packed as uint32 for fast lookup.
+        palette = np.zeros((4, 4), np.uint8)
+        palette[:, :3] = np.array([[0, 0, 0], [255, 255, 255], [0, 255, 0], [255, 0, 0]]) // 2
+        palette = palette.view(np.uint32).ravel()
+        self._layout_colors = np.full(256, palette[0])  # maze_layout value => color
+        self._layout_colors[:3] = palette[:3]
+        self._agent_color = palette[3]
 
     def observation_spec(self):
         spec = self.env.observation_spec()
@@ -41,8 +87,6 @@ class DrawMinimapWrapper(ObservationWrapper):
         return spec
 
     def observation(self, obs):
-        from PIL import Image
-
         assert isinstance(obs, dict)
         maze = obs['maze_layout']
         x, y = obs['agent_pos']
@@ -51,30 +95,220 @@ class DrawMinimapWrapper(ObservationWrapper):
         N = maze.shape[0]
         SIZE = N * 2
 
-        # Draw map
-        map = np.zeros((N, N, 3), np.uint8)  # walls in black
-        map[:, :] += (maze == 1)[..., None] * np.array([[[255, 255, 255]]], np.uint8)  # corridors in white
-        map[:, :] += (maze == 2)[..., None] * np.array([[[0, 255, 0]]], np.uint8)  # path in green
-        map[int(y), int(x)] = np.array([255, 0, 0], np.uint8)  # agent in red
-        map = np.flip(map, 0)
+        # Draw map, with extra row and column in black for pixels outside of the map
+        map = np.zeros((N + 1, N + 1), np.uint32)
+        map[:N, :N] = self._layout_colors[maze[::-1]]
+        map[N - 1 - int(y), int(x)] = self._agent_color
 
-        # Scale, rotate, translate
-        mapimg = Image.fromarray(map)
-        mapimg = mapimg.resize((SIZE, SIZE), resample=0)
+        # Scale, translate, rotate
         tx = (x - N / 2) / N * SIZE
         ty = - (y - N / 2) / N * SIZE
-        mapimg = mapimg.transform(mapimg.size, 0,
-                                  (1, 0, tx,
-                                   0, 1, ty),
-                                  resample=0)
-        mapimg = mapimg.rotate(angle / np.pi * 180, resample=0)
+        rows, cols = _rotation_table(SIZE, angle / np.pi * 180)
+        cells = _translation_table(SIZE, ty, N + 1)[rows] + _translation_table(SIZE, tx, 1)[cols]
 
         # Overlay minimap onto observation image top-right corner
-        img = obs['image']
-        img[:SIZE, -SIZE:] = img[:SIZE, -SIZE:] // 2 + np.array(mapimg) // 2
+        img = obs['image'][:SIZE, -SIZE:]
+        img //= 2
+        img += map.ravel()[cells].view(np.uint8).reshape((SIZE, SIZE, 4))[..., :3]
         return obs
 
 
+def _rotation_table(size: int, angle: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Source row and column of each pixel of Image.rotate(angle, resample=NEAREST).
+
+    Coordinates are offset by size, which keeps them non-negative, because rotation
+    moves pixels less than size away.
+    """
+    # As in Image.rotate()
+    angle = angle % 360.0
+    if angle in (0, 90, 180, 270):
+        return _transpose_table(size, int(angle))
+    center = size / 2
+    angle = -math.radians(angle)
+    a = [round(math.cos(angle), 15), round(math.sin(angle), 15), 0.0, round(-math.sin(angle), 15), round(math.cos(angle), 15), 0.0]
+    a[2] = a[0] * -center + a[1] * -center + a[2] + center
+    a[5] = a[3] * -center + a[4] * -center + a[5] + center
+
+    if a[1] == 0 and a[3] == 0:
+        # As in ImagingScaleAffine()
+        cols = _coords(size, a[2] + a[0] * 0.5, a[0])
+        rows = _coords(size, a[5] + a[4] * 0.5, a[4])
+        cols = np.where((cols >= 0) & (cols < size), cols, -size)  # Pixels outside stay outside with the offset
+        rows = np.where((rows >= 0) & (rows < size), rows, -size)
+        return np.broadcast_arrays(rows[:, None] + size, cols[None, :] + size)
+
+    # As in affine_fixed(), with 16.16 fixed point arithmetics
+    a0, a1, a3, a4 = (math.floor(v * 65536.0 + 0.5) for v in (a[0], a[1], a[3], a[4]))
+    a2 = math.floor((a[2] + a[0] * 0.5 + a[1] * 0.5) * 65536.0 + 0.5) + (size << 16)
+    a5 = math.floor((a[5] + a[3] * 0.5 + a[4] * 0.5) * 65536.0 + 0.5) + (size << 16)
+    pixels = np.arange(size)
+    rows = np.add.outer(a5 + a4 * pixels, a3 * pixels) >> 16
+    cols = np.add.outer(a2 + a1 * pixels, a0 * pixels) >> 16
+    return rows, cols
+
+
+@functools.lru_cache(maxsize=None)
+def _transpose_table(size: int, angle: int) -> Tuple[np.ndarray, np.ndarray]:
+    """As in _rotation_table(), for Image.transpose(ROTATE_90) etc, which rotate counter-clockwise like np.rot90()."""
+    rows, cols = np.mgrid[:size, :size] + size
+    return np.ascontiguousarray(np.rot90(rows, angle // 90)), np.ascontiguousarray(np.rot90(cols, angle // 90))
+
+
+def _translation_table(size: int, t: float, scale: int) -> np.ndarray:
+    """Map cell of each pixel after resize() by 2x and transform() by offset t, as in PIL ImagingScaleAffine().
+
+    Indexed by pixel coordinate + size, returns cell * scale, where cell = size / 2 for
+    pixels outside of the map.
+    """
+    table = [size // 2 * scale] * (size * 3)
+    coord = t + 0.5
+    for i in range(size, size * 2):
+        if 0 <= coord < size:
+            table[i] = int(coord) // 2 * scale
+        coord += 1.0  # Accumulated with the same rounding as in PIL
+    return np.array(table)
+
+
+def _coords(size: int, start: float, step: float) -> np.ndarray:
+    """COORD() of source coordinates, accumulated with the same rounding as in PIL."""
+    coords = []
+    for _ in range(size):
+        coords.append(-1 if start < 0 else int(start))
+        start += step
+    return np.array(coords)
+
+
+class DistanceField:
+    """Shortest path distances to finish cell from every cell of the maze, and the next cell
+    on a shortest path from each cell, computed with a vectorized breadth-first search."""
+
+    # Neighbour offsets (dx, dy), in the same order as breadth_first_search()
+    NEIGHBOURS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+    def __init__(self, maze: np.ndarray, finish: Tuple[int, int]):
+        self.finish = finish
+        self.distance = _distance_field(maze != 0, finish)
+        self.next_hop = _next_hop(self.distance)
+
+    def path(self, start: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
+        """Shortest path from start to finish, inclusive, or None if unreachable."""
+        xs, ys = start
+        h, w = self.distance.shape
+        if not (0 <= xs < w and 0 <= ys < h):
+            return None
+        path = [(xs, ys)]
+        if self.distance[ys, xs] < 0:
+            # Start is not reachable (e.g. inside wall), continue from the closest neighbour, like breadth_first_search()
+            neighbours = [(xs + dx, ys + dy) for dx, dy in self.NEIGHBOURS
+                          if 0 <= xs + dx < w and 0 <= ys + dy < h and self.distance[ys + dy, xs + dx] >= 0]
+            if not neighbours:
+                return None
+            xs, ys = min(neighbours, key=lambda xy: self.distance[xy[1], xy[0]])
+            path.append((xs, ys))
+        while (xs, ys) != self.finish:
+            xs, ys = self.next_hop[ys, xs]
+            path.append((xs, ys))
+        return path
+
+
+class BatchOraclePolicy:
+    """Navigates a batch of envs to target_pos along shortest paths in the maze layout.
+
+    Takes (N, ...) arrays of the ExtraObs observables and returns (N,) discrete action ids.
+    Next-hop maps are kept per env and only recomputed when the layout or target cell of
+    that env changes, so each step is a few vectorized lookups.
+    """
+
+    def __init__(self, forward_angle: float = 15.0, turn_angle: float = 45.0):
+        self.forward_angle = forward_angle
+        self.turn_angle = turn_angle
+        self._layouts = None  # (N, H, W)
+        self._targets = None  # (N, 2) target cells (x, y)
+        self._next_hop = None  # (N, H, W, 2)
+        self._distance = None  # (N, H, W)
+
+    def __call__(self, agent_pos: np.ndarray, agent_dir: np.ndarray, target_pos: np.ndarray, maze_layout: np.ndarray) -> np.ndarray:
+        cells = agent_pos.astype(int)
+        targets = target_pos.astype(int)
+        self._update_fields(maze_layout, targets)
+        n = np.arange(len(cells))
+        x, y = cells[:, 0], cells[:, 1]
+        next_cells = self._next_hop[n, y, x]
+        # Head to the center of the next cell, or straight to the target in its cell,
+        # or if the agent cell is unreachable (e.g. rounding into a wall)
+        direct = (self._distance[n, y, x] <= 0)[:, None]
+        waypoints = np.where(direct, target_pos, next_cells + 0.5)
+        return navigation_actions(agent_pos, agent_dir, waypoints, self.forward_angle, self.turn_angle)
+
+    def _update_fields(self, layouts: np.ndarray, targets: np.ndarray):
+        if self._layouts is None or self._layouts.shape != layouts.shape:
+            n, h, w = layouts.shape
+            self._layouts = np.zeros(layouts.shape, layouts.dtype)
+            self._targets = np.full((n, 2), -1)
+            self._next_hop = np.zeros((n, h, w, 2), int)
+            self._distance = np.zeros((n, h, w), int)
+        changed = np.any(self._layouts != layouts, axis=(1, 2)) | np.any(self._targets != targets, axis=1)
+        for i in np.flatnonzero(changed):
+            field = DistanceField(layouts[i], tuple(targets[i]))
+            self._layouts[i] = layouts[i]
+            self._targets[i] = targets[i]
+            self._next_hop[i] = field.next_hop
+            self._distance[i] = field.distance
+
+
+def navigation_actions(agent_pos: np.ndarray, agent_dir: np.ndarray, waypoints: np.ndarray, forward_angle: float, turn_angle: float) -> np.ndarray:
+    """(N,) actions towards (N, 2) waypoints: turn in place if the waypoint is more than turn_angle
+    (degrees) away from agent_dir, move forward with a turn if it's more than forward_angle away,
+    and move forward otherwise."""
+    delta = waypoints - agent_pos
+    cross = agent_dir[:, 0] * delta[:, 1] - agent_dir[:, 1] * delta[:, 0]
+    dot = agent_dir[:, 0] * delta[:, 0] + agent_dir[:, 1] * delta[:, 1]
+    angle = np.degrees(np.arctan2(cross, dot))  # Positive = counter-clockwise = left
+    left = angle > 0
+    return np.where(
+        np.abs(angle) > turn_angle,
+        np.where(left, LEFT, RIGHT),
+        np.where(np.abs(angle) > forward_angle, np.where(left, FORWARD_LEFT, FORWARD_RIGHT), FORWARD))
+
+
+def _shift(grid: np.ndarray, dx: int, dy: int, fill) -> np.ndarray:
+    """result[y, x] = grid[y + dy, x + dx], or fill outside the grid."""
+    h, w = grid.shape
+    result = np.full_like(grid, fill)
+    result[max(-dy, 0):h - max(dy, 0), max(-dx, 0):w - max(dx, 0)] = grid[max(dy, 0):h - max(-dy, 0), max(dx, 0):w - max(-dx, 0)]
+    return result
+
+
+def _distance_field(free: np.ndarray, finish: Tuple[int, int]) -> np.ndarray:
+    distance = np.full(free.shape, -1, int)  # -1 for unreachable
+    xf, yf = finish
+    if not free[yf, xf]:
+        return distance
+    frontier = np.zeros_like(free)
+    frontier[yf, xf] = True
+    d = 0
+    while frontier.any():
+        distance[frontier] = d
+        d += 1
+        expanded = np.zeros_like(frontier)
+        for dx, dy in DistanceField.NEIGHBOURS:
+            expanded |= _shift(frontier, dx, dy, False)
+        frontier = expanded & free & (distance < 0)
+    return distance
+
+
+def _next_hop(distance: np.ndarray) -> np.ndarray:
+    h, w = distance.shape
+    next_hop = np.zeros((h, w, 2), int)  # (x, y) of the next cell, towards finish
+    assigned = distance <= 0
+    ys, xs = np.mgrid[:h, :w]
+    for dx, dy in DistanceField.NEIGHBOURS:
+        closer = ~assigned & (_shift(distance, dx, dy, -1) == distance - 1)
+        next_hop[closer] = np.stack([xs[closer] + dx, ys[closer] + dy], axis=-1)
+        assigned |= closer
+    return next_hop
+
+
 def breadth_first_search(maze: np.ndarray, start: Tuple[int, int], finish: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
     h, w = maze.shape
 
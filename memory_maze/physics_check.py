@@ -0,0 +1,176 @@
+"""Equivalence check of a physics profile against the default physics.
+
+Replays fixed action sequences under both profiles, starting from the same episode
+(same maze, targets and spawn via reset(episode_index)), and reports how the agent
+trajectories, target collections and wall contacts differ, and the speedup:
+
+    python -m memory_maze.physics_check --profile fast --size 9x9 --episodes 10
+
+The action sequences come from the scripted policy of memory_maze.datagen, run under the
+default profile, with extra action noise so that the agent also bumps into walls.
+
+Open-loop replay is chaotic: after a wall collision, even a tiny difference in position
+sends the agent on a different path, so full-episode trajectories diverge under any change
+of timestep. The local error is therefore measured too: from each state of the default
+trajectory (restored with snapshot()/restore()), one control step under each profile, and
+whether the position, wall contact and target collection after it agree. Task semantics at
+the episode level are compared by running the scripted policy closed-loop under each profile.
+"""
+import argparse
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from memory_maze.maze import _WALL_GEOM_GROUP, MemoryMazeEnvironment
+
+
+def unwrap(env) -> MemoryMazeEnvironment:
+    """The MemoryMazeEnvironment under the observation and action wrappers."""
+    while not isinstance(env, MemoryMazeEnvironment):
+        env = env.env
+    return env
+
+
+def _make_env(size: str, seed: int, profile: str):
+    from memory_maze import SIZES
+    return SIZES[size](seed=seed, global_observables=True, state_only=True, physics_profile=profile)
+
+
+def wall_contact(base: MemoryMazeEnvironment) -> bool:
+    """Whether the walker touches a wall at the end of the control step."""
+    physics = base.physics
+    model, data = physics.model, physics.data
+    walker_root = model.body_rootid[physics.bind(base.task.walker.root_body).element_id]
+    for contact in data.contact[:data.ncon]:
+        geoms = (contact.geom1, contact.geom2)
+        walker = [model.body_rootid[model.geom_bodyid[g]] == walker_root for g in geoms]
+        if any(walker) and not all(walker) and model.geom_group[geoms[walker.index(False)]] == _WALL_GEOM_GROUP:
+            return True
+    return False
+
+
+def run_policy(size: str, profile: str, seed: int, episode: int, action_noise: float = 0.3, steps: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Closed-loop episode of the datagen scripted policy: actions, positions, rewards and wall contacts."""
+    from memory_maze.datagen import ScriptedPolicy
+
+    env = _make_env(size, seed, profile)
+    base = unwrap(env)
+    policy = ScriptedPolicy(np.random.RandomState([seed, episode]), action_noise)
+    ts = env.reset(episode_index=episode)
+    actions, pos, reward, contact = [], [], [], []
+    elapsed = 0.0
+    while not ts.last() and (steps is None or len(actions) < steps):
+        actions.append(policy(ts.observation))
+        start = time.perf_counter()
+        ts = env.step(actions[-1])
+        elapsed += time.perf_counter() - start
+        pos.append(ts.observation['agent_pos'])
+        reward.append(ts.reward)
+        contact.append(wall_contact(base))
+    env.close()
+    return dict(action=np.array(actions), pos=np.array(pos), reward=np.array(reward), contact=np.array(contact), time=elapsed)
+
+
+def replay(size: str, profile: str, seed: int, episode: int, actions: np.ndarray) -> Dict[str, np.ndarray]:
+    """Open-loop trajectory of the action sequence from the episode start."""
+    env = _make_env(size, seed, profile)
+    base = unwrap(env)
+    ts = env.reset(episode_index=episode)
+    pos, reward, contact = [], [], []
+    for action in actions:
+        ts = env.step(action)
+        pos.append(ts.observation['agent_pos'])
+        reward.append(ts.reward)
+        contact.append(wall_contact(base))
+        if ts.last():
+            break
+    env.close()
+    return dict(pos=np.array(pos), reward=np.array(reward), contact=np.array(contact))
+
+
+def one_step(size: str, profile: str, seed: int, episode: int, actions: np.ndarray) -> Dict[str, np.ndarray]:
+    """From each state of the default trajectory, one control step under the profile. Returns the
+    position error (in maze cells) and whether wall contact and reward agree with the default step."""
+    ref_env, env = _make_env(size, seed, 'default'), _make_env(size, seed, profile)
+    ref_base, base = unwrap(ref_env), unwrap(env)
+    ref_env.reset(episode_index=episode)
+    env.reset(episode_index=episode)
+    pos_err, contact_match, reward_match = [], [], []
+    for action in actions:
+        env.restore(ref_env.snapshot())
+        ts, ref_ts = env.step(action), ref_env.step(action)
+        pos_err.append(np.linalg.norm(ts.observation['agent_pos'] - ref_ts.observation['agent_pos']))
+        contact_match.append(wall_contact(base) == wall_contact(ref_base))
+        reward_match.append(ts.reward == ref_ts.reward)
+        if ref_ts.last():
+            break
+    env.close()
+    ref_env.close()
+    return dict(pos_err=np.array(pos_err), contact_match=np.array(contact_match), reward_match=np.array(reward_match))
+
+
+def compare(size: str = '9x9', profile: str = 'fast', seed: int = 0, episodes: int = 5, action_noise: float = 0.3, steps: Optional[int] = None) -> List[dict]:
+    """Per-episode differences of the profile from the default physics."""
+    results = []
+    for episode in range(episodes):
+        ref = run_policy(size, 'default', seed, episode, action_noise, steps)
+        res = run_policy(size, profile, seed, episode, action_noise, steps)
+        open_loop = replay(size, profile, seed, episode, ref['action'])
+        local = one_step(size, profile, seed, episode, ref['action'])
+        n = min(len(ref['pos']), len(open_loop['pos']))
+        drift = np.linalg.norm(ref['pos'][:n] - open_loop['pos'][:n], axis=-1)
+        results.append(dict(
+            episode=episode,
+            steps=len(ref['action']),
+            step_err_mean=float(local['pos_err'].mean()),
+            step_err_max=float(local['pos_err'].max()),
+            step_contact_match=float(local['contact_match'].mean()),
+            step_reward_match=float(local['reward_match'].mean()),
+            diverged_at=int(np.argmax(drift > 0.5)) if (drift > 0.5).any() else None,
+            targets_ref=int(ref['reward'].sum()),
+            targets=int(res['reward'].sum()),
+            contacts_ref=int(ref['contact'].sum()),
+            contacts=int(res['contact'].sum()),
+            speedup=ref['time'] / res['time'],
+        ))
+    return results
+
+
+def _print_results(results: List[dict], profile: str):
+    print(f'{"episode":>7} {"steps":>5} {"1-step err":>10} {"1-step max":>10} {"contact ok":>10} {"reward ok":>9} '
+          f'{"diverged":>8} {"targets":>9} {"contacts":>11} {"speedup":>7}')
+    for r in results:
+        print(f'{r["episode"]:>7} {r["steps"]:>5} {r["step_err_mean"]:>10.4f} {r["step_err_max"]:>10.4f} '
+              f'{r["step_contact_match"]:>10.1%} {r["step_reward_match"]:>9.1%} {str(r["diverged_at"]):>8} '
+              f'{r["targets_ref"]:>4}/{r["targets"]:<4} {r["contacts_ref"]:>5}/{r["contacts"]:<5} {r["speedup"]:>6.1f}x')
+    print()
+    print('1-step: one control step from the same state, error in maze cells, and agreement of wall contact and reward.')
+    print('diverged: first step of open-loop replay with position error > 0.5 cells.')
+    print(f'targets, contacts: closed-loop scripted policy, default/{profile}.')
+    print()
+    print(f'Mean 1-step error: {np.mean([r["step_err_mean"] for r in results]):.4f} cells, '
+          f'contact agreement: {np.mean([r["step_contact_match"] for r in results]):.1%}, '
+          f'reward agreement: {np.mean([r["step_reward_match"] for r in results]):.1%}')
+    print(f'Targets: {sum(r["targets_ref"] for r in results)}/{sum(r["targets"] for r in results)}, '
+          f'contact steps: {sum(r["contacts_ref"] for r in results)}/{sum(r["contacts"] for r in results)}, '
+          f'speedup: {np.mean([r["speedup"] for r in results]):.1f}x')
+
+
+def main(argv: Optional[List[str]] = None):
+    from memory_maze.maze import PHYSICS_PROFILES
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', type=str, default='fast', choices=[p for p in PHYSICS_PROFILES if p != 'default'])
+    parser.add_argument('--size', type=str, default='9x9', choices=['9x9', '11x11', '13x13', '15x15'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--episodes', type=int, default=5)
+    parser.add_argument('--action-noise', type=float, default=0.3)
+    parser.add_argument('--steps', type=int, default=None, help='Steps per episode (default: full episode)')
+    args = parser.parse_args(argv)
+    results = compare(args.size, args.profile, args.seed, args.episodes, args.action_noise, args.steps)
+    _print_results(results, args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Selection of the MuJoCo rendering backend (MUJOCO_GL).
+
+If MUJOCO_GL is not set, each candidate backend is probed in a subprocess with a tiny
+offscreen render, and the fastest one that works is used. The choice is cached per host
+in ~/.cache/memory_maze/rendering.json (or $MEMORY_MAZE_CACHE_DIR), so the probe runs
+only once. Delete the cache file to probe again, e.g. after installing GPU drivers.
+
+    >>> from memory_maze import rendering
+    >>> rendering.backend_info()
+    {'backend': 'egl', 'source': 'cache', 'fps': {'egl': 1650.2, 'osmesa': 210.4}, ...}
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+CANDIDATES = ['egl', 'osmesa']
+CACHE_FILE = 'rendering.json'
+PROBE_TIMEOUT = 60
+PROBE_PREFIX = 'PROBE_RESULT '
+
+_PROBE_SCRIPT = f'''
+import json, time
+from dm_control import mujoco
+physics = mujoco.Physics.from_xml_string(
+    '<mujoco><worldbody><light pos="0 0 1"/><geom type="sphere" size=".1"/></worldbody></mujoco>')
+physics.render(64, 64)  # Warmup, includes context creation
+n, start = 0, time.perf_counter()
+while time.perf_counter() - start < 0.2:
+    physics.render(64, 64)
+    n += 1
+print({PROBE_PREFIX!r} + json.dumps(n / (time.perf_counter() - start)))
+'''
+
+_info: Optional[dict] = None
+
+
+def select_backend(candidates: List[str] = CANDIDATES) -> str:
+    """Sets MUJOCO_GL, if not already set, to the cached or probed backend.
+
+    Must be called before dm_control is imported.
+    """
+    global _info
+    if _info is not None:
+        return _info['backend']
+    if os.environ.get('MUJOCO_GL'):
+        _info = {'backend': os.environ['MUJOCO_GL'], 'source': 'env'}
+        return _info['backend']
+
+    host = platform.node()
+    cache = _read_cache()
+    info = cache.get(host)
+    if info and info.get('candidates') == candidates:
+        _info = dict(info, source='cache')
+    else:
+        fps = {backend: probe_backend(backend) for backend in candidates}
+        working = {backend: value for backend, value in fps.items() if value is not None}
+        # If nothing works, keep egl (the previous default), so the error shows up on first render
+        backend = max(working, key=working.get) if working else candidates[0]
+        info = {'backend': backend, 'fps': fps, 'candidates': candidates, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        cache[host] = info
+        _write_cache(cache)
+        _info = dict(info, source='probe')
+    os.environ['MUJOCO_GL'] = _info['backend']
+    return _info['backend']
+
+
+def backend_info() -> dict:
+    """The selected backend, with the measured frames/sec of each candidate (None if it failed)."""
+    if _info is None:
+        select_backend()
+    return dict(_info)
+
+
+def probe_backend(backend: str) -> Optional[float]:
+    """Frames/sec of a 64x64 offscreen render with the backend, or None if it doesn't work."""
+    env = dict(os.environ, MUJOCO_GL=backend)
+    env.pop('PYOPENGL_PLATFORM', None)  # Let dm_control choose it for the backend
+    try:
+        proc = subprocess.run([sys.executable, '-c', _PROBE_SCRIPT], env=env, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return None
+    for line in proc.stdout.splitlines():
+        if line.startswith(PROBE_PREFIX):
+            return float(line[len(PROBE_PREFIX):])
+    return None
+
+
+def _cache_path() -> Path:
+    cache_dir = os.environ.get('MEMORY_MAZE_CACHE_DIR') or Path.home() / '.cache' / 'memory_maze'
+    return Path(cache_dir) / CACHE_FILE
+
+
+def _read_cache() -> Dict[str, dict]:
+    try:
+        return json.loads(_cache_path().read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache: Dict[str, dict]):
+    path = _cache_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(cache, indent=2))
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # Read-only home, probe again next time
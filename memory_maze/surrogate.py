@@ -0,0 +1,401 @@
+"""Batched kinematic surrogate of Memory Maze in pure NumPy, for cheap large-scale pretraining.
+
+SurrogateMaze steps thousands of mazes at once as (N, ...) arrays. It has the same maze
+generator (TextMazeVaryingWalls), target placement, discrete action set and ExtraObs
+observation keys as the real env, but no MuJoCo and no rendering: the rolling ball is a
+kinematic agent whose forward speed and turn rate follow the action with a first-order lag,
+and which slides along the walls of the grid. The constants are fitted to step responses
+of the real walker.
+
+    env = SurrogateMaze('9x9', num_envs=4096, seed=0)
+    obs = env.reset()  # obs['agent_pos'].shape == (4096, 2)
+    obs, reward, done, info = env.step(actions)  # finished envs are reset automatically
+
+Collisions are approximate (no bouncing or spinning off walls), and there is no image, so
+it is meant for curricula and pretraining of the state-based parts of agents. The
+calibration report compares motion statistics with the real env:
+
+    python -m memory_maze.surrogate --size 9x9
+"""
+import argparse
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import labmaze
+import numpy as np
+from dm_env import specs
+
+from memory_maze.maze import TARGET_COLORS, TextMazeVaryingWalls
+from memory_maze.tasks import ACTIONS as TASK_ACTIONS
+from memory_maze.tasks import DEFAULT_CONTROL_FREQ, MAZE_SIZES
+
+# Discrete action set of tasks._memory_maze(), as (N, 2) array of (roll, steer) walker controls
+ACTIONS = np.array(TASK_ACTIONS)
+
+# Kinematics fitted to step responses of RollingBallWithFriction with the default physics,
+# in maze cells (xy_scale=2.0) and seconds
+SPEED = 0.99  # Forward speed at full roll
+SPEED_TAU = 0.19  # Time constant of the speed response
+TURN_RATE = np.radians(73.6)  # Turn rate at full steer
+TURN_TAU = 0.055  # Time constant of the turn rate response
+AGENT_RADIUS = 0.1  # Ball radius 0.2m, closest the agent gets to a wall
+TARGET_RADIUS = 0.39  # Horizontal distance at which the ball touches a target sphere
+
+_FREE = [' ', labmaze.defaults.SPAWN_TOKEN, labmaze.defaults.OBJECT_TOKEN]
+
+
+class SurrogateMaze:
+    """Batch of num_envs kinematic Memory Maze envs.
+
+    Has the interface of MemoryMazeVecEnv: reset() and step(actions) return dicts of
+    (num_envs, ...) arrays with the ExtraObs keys (without image), and finished episodes
+    are reset automatically, returning the first observation of the next episode.
+    info['wall_contact'] is whether the agent touched a wall at any time during the step.
+    """
+
+    def __init__(
+        self,
+        size: str = '9x9',
+        num_envs: int = 1024,
+        seed: Optional[int] = None,
+        control_freq: float = DEFAULT_CONTROL_FREQ,
+        substeps: int = 5,
+        randomize_colors: bool = False,
+    ):
+        maze_size, n_targets, time_limit, maze_kwargs = MAZE_SIZES[size]
+        self.num_envs = num_envs
+        self.maze_size = maze_size
+        self.n_targets = n_targets
+        self.episode_steps = int(round(time_limit * control_freq))
+        self.control_timestep = 1.0 / control_freq
+        self.substeps = substeps
+        self.randomize_colors = randomize_colors
+        self._rng = np.random.RandomState(seed)
+        # Same generator arguments as MazeWithTargetsArena in tasks._memory_maze()
+        self._maze = TextMazeVaryingWalls(
+            height=maze_size + 2,
+            width=maze_size + 2,
+            **dict(dict(max_rooms=6, room_min_size=3, room_max_size=5), **maze_kwargs),
+            max_variations=26,
+            spawns_per_room=1,
+            objects_per_room=1,
+            simplify=True,
+            random_seed=self._rng.randint(2147483648),
+        )
+
+        n, s = num_envs, maze_size
+        self._walls = np.ones((n, s + 2, s + 2), bool)  # Including outer walls, cell (x, y) at [y + 1, x + 1]
+        self._layout = np.zeros((n, s, s), np.uint8)
+        self._targets_pos = np.zeros((n, n_targets, 2))
+        self._colors = np.zeros((n, n_targets, 3))
+        self._target_ix = np.zeros(n, int)
+        self._pos = np.zeros((n, 2))
+        self._angle = np.zeros(n)
+        self._speed = np.zeros(n)
+        self._turn = np.zeros(n)
+        self._steps = np.zeros(n, int)
+
+    def observation_spec(self) -> Dict[str, specs.Array]:
+        """Observation spec of a single env, as of the real ExtraObs env without image."""
+        s, t = self.maze_size, self.n_targets
+        return {
+            'target_color': specs.Array((3,), float, 'target_color'),
+            'agent_pos': specs.Array((2,), float, 'agent_pos'),
+            'agent_dir': specs.Array((2,), float, 'agent_dir'),
+            'targets_vec': specs.Array((t, 2), float, 'targets_vec'),
+            'targets_pos': specs.Array((t, 2), float, 'targets_pos'),
+            'target_vec': specs.Array((2,), float, 'target_vec'),
+            'target_pos': specs.Array((2,), float, 'target_pos'),
+            'maze_layout': specs.BoundedArray((s, s), np.uint8, 0, 1, 'maze_layout'),
+        }
+
+    def action_spec(self) -> specs.DiscreteArray:
+        return specs.DiscreteArray(len(ACTIONS), name='action')
+
+    def reset(self) -> Dict[str, np.ndarray]:
+        self._reset_envs(np.arange(self.num_envs))
+        return self._observation()
+
+    def step(self, actions) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, Dict[str, Any]]:
+        controls = ACTIONS[np.asarray(actions)]
+        speed_cmd = -controls[:, 0] * SPEED  # roll=-1 is forward
+        turn_cmd = -controls[:, 1] * TURN_RATE  # steer=-1 is left, counterclockwise
+        dt = self.control_timestep / self.substeps
+        touched = np.zeros((self.num_envs, self.n_targets), bool)
+        contact = np.zeros(self.num_envs, bool)
+        for _ in range(self.substeps):
+            distance, self._speed = _first_order(self._speed, speed_cmd, SPEED_TAU, dt)
+            angle, self._turn = _first_order(self._turn, turn_cmd, TURN_TAU, dt)
+            heading = self._angle + angle / 2
+            direction = np.stack([np.cos(heading), np.sin(heading)], -1)
+            pos, blocked = self._collide(self._pos, self._pos + distance[:, None] * direction)
+            # Against a wall, the ball keeps only the speed of sliding along it
+            self._speed = np.where(blocked, np.maximum(np.sum((pos - self._pos) * direction, -1) / dt, 0.0), self._speed)
+            self._pos = pos
+            contact |= blocked
+            self._angle = (self._angle + angle) % (2 * np.pi)
+            touched |= np.linalg.norm(self._targets_pos - self._pos[:, None], axis=-1) < TARGET_RADIUS
+
+        # As MemoryMazeTask.after_step(): reward for touching the current target, then
+        # pick a new one among the targets not touched in this step
+        n = np.arange(self.num_envs)
+        rewarded = touched[n, self._target_ix]
+        if rewarded.any():
+            scores = np.where(touched, -1.0, self._rng.rand(self.num_envs, self.n_targets))
+            self._target_ix = np.where(rewarded, np.argmax(scores, -1), self._target_ix)
+        reward = rewarded.astype(float)
+        info = {'wall_contact': contact}
+
+        self._steps += 1
+        done = self._steps >= self.episode_steps
+        info['TimeLimit.truncated'] = done.copy()  # Episodes only end by time limit
+        if done.any():
+            self._reset_envs(np.flatnonzero(done))
+        return self._observation(), reward, done, info
+
+    def close(self):
+        pass
+
+    def _reset_envs(self, env_ids: np.ndarray):
+        rng = self._rng
+        for i in env_ids:
+            while True:
+                self._maze.regenerate()
+                grid = np.flip(np.asarray(self._maze.entity_layer), 0)  # Bottom row first, as maze_layout
+                targets = np.argwhere(grid == labmaze.defaults.OBJECT_TOKEN)[:, ::-1] - 0.5  # Cell centers (x, y)
+                if len(targets) >= self.n_targets:
+                    break  # Otherwise too few rooms, regenerate as MemoryMazeTask does
+            spawns = np.argwhere(grid == labmaze.defaults.SPAWN_TOKEN)[:, ::-1] - 0.5
+            self._walls[i] = ~np.isin(grid, _FREE)
+            self._layout[i] = ~self._walls[i, 1:-1, 1:-1]
+            rng.shuffle(targets)
+            self._targets_pos[i] = targets[:self.n_targets]
+            colors = rng.permutation(len(TARGET_COLORS)) if self.randomize_colors else np.arange(len(TARGET_COLORS))
+            self._colors[i] = np.array(TARGET_COLORS)[colors[:self.n_targets]]
+            self._target_ix[i] = rng.randint(self.n_targets)
+            self._pos[i] = spawns[rng.randint(len(spawns))]
+            self._angle[i] = rng.uniform(0, 2 * np.pi)  # Uniform, as NullGoalMaze._respawn() without rotation bias
+        self._speed[env_ids] = 0.0
+        self._turn[env_ids] = 0.0
+        self._steps[env_ids] = 0
+
+    def _is_wall(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        s = self.maze_size + 1
+        col = np.clip(np.floor(x).astype(int) + 1, 0, s)
+        row = np.clip(np.floor(y).astype(int) + 1, 0, s)
+        return self._walls[np.arange(self.num_envs), row, col]
+
+    def _collide(self, pos: np.ndarray, new_pos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Moves along x, then y, stopping AGENT_RADIUS from walls. Steps are shorter than
+        AGENT_RADIUS, so checking the cells under the leading edge is enough."""
+        r, eps = AGENT_RADIUS, 1e-6
+        x, y = new_pos[:, 0].copy(), pos[:, 1].copy()
+        blocked = np.zeros(self.num_envs, bool)
+        for axis in range(2):
+            along, across = (x, y) if axis == 0 else (y, x)
+            sign = np.sign(new_pos[:, axis] - pos[:, axis])
+            edge = along + sign * r
+            hit = np.zeros(self.num_envs, bool)
+            for offset in (-r + eps, r - eps):
+                cells = (edge, across + offset) if axis == 0 else (across + offset, edge)
+                hit |= self._is_wall(*cells)
+            hit &= sign != 0
+            along[hit] = np.where(sign[hit] > 0, np.floor(edge[hit]) - r, np.floor(edge[hit]) + 1 + r)
+            blocked |= hit
+            if axis == 0:
+                y = new_pos[:, 1].copy()
+        return np.stack([x, y], -1), blocked
+
+    def _observation(self) -> Dict[str, np.ndarray]:
+        n = np.arange(self.num_envs)
+        direction = np.stack([np.cos(self._angle), np.sin(self._angle)], -1)
+        right = np.stack([direction[:, 1], -direction[:, 0]], -1)
+        vec = self._targets_pos - self._pos[:, None]
+        # Egocentric, in the walker frame (x to the right, y forward), as walker/target_rel_{i}
+        targets_vec = np.stack([np.sum(vec * right[:, None], -1), np.sum(vec * direction[:, None], -1)], -1)
+        return {
+            'target_color': self._colors[n, self._target_ix],
+            'agent_pos': self._pos.copy(),
+            'agent_dir': direction,
+            'targets_vec': targets_vec,
+            'targets_pos': self._targets_pos.copy(),
+            'target_vec': targets_vec[n, self._target_ix],
+            'target_pos': self._targets_pos[n, self._target_ix],
+            'maze_layout': self._layout.copy(),
+        }
+
+
+def _first_order(rate: np.ndarray, target: np.ndarray, tau: float, dt: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact integral over dt of a rate relaxing to target with time constant tau: (distance, new rate)."""
+    decay = np.exp(-dt / tau)
+    distance = target * dt + (rate - target) * tau * (1.0 - decay)
+    return distance, target + (rate - target) * decay
+
+
+def _random_actions(rng: np.random.RandomState, steps: int, n: int, mean_hold: float = 4.0) -> np.ndarray:
+    """(steps, n) random actions, each held for a geometric number of steps, so that both
+    the transients and the steady state of every action are visited."""
+    actions = np.zeros((steps, n), int)
+    current = rng.randint(len(ACTIONS), size=n)
+    for t in range(steps):
+        change = rng.rand(n) < 1.0 / mean_hold
+        current = np.where(change, rng.randint(len(ACTIONS), size=n), current)
+        actions[t] = current
+    return actions
+
+
+def _near_wall(pos: np.ndarray, layout: np.ndarray, distance: float) -> np.ndarray:
+    """Whether positions (T, n, 2) are within distance (along x, y or diagonally) of a wall of the (n, H, W) layouts."""
+    n = np.arange(layout.shape[0])
+    near = np.zeros(pos.shape[:-1], bool)
+    for dx in (-distance, 0.0, distance):
+        for dy in (-distance, 0.0, distance):
+            x = np.floor(pos[..., 0] + dx).astype(int)
+            y = np.floor(pos[..., 1] + dy).astype(int)
+            inside = (x >= 0) & (x < layout.shape[2]) & (y >= 0) & (y < layout.shape[1])
+            near |= ~inside | (layout[n, y.clip(0, layout.shape[1] - 1), x.clip(0, layout.shape[2] - 1)] == 0)
+    return near
+
+
+def _motion_stats(run: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Per-action displacement and turn per step, on the first step of the action and once held
+    for 3+ steps. Only steps in open space (start and end 0.3 cells away from walls) are counted,
+    so that both envs are compared on free motion, not on how they bounce off walls."""
+    pos, direction, actions, contact = run['pos'], run['dir'], run['action'], run['contact']
+    disp = np.linalg.norm(pos[1:] - pos[:-1], axis=-1)
+    angle = np.arctan2(direction[..., 1], direction[..., 0])
+    turn = np.degrees((angle[1:] - angle[:-1] + np.pi) % (2 * np.pi) - np.pi)
+    near = _near_wall(pos, run['layout'], 0.3)
+    valid = ~near[1:] & ~near[:-1]
+    prev = np.concatenate([np.full((2,) + actions.shape[1:], -1), actions[:-1]], 0)
+    first = actions != prev[1:]
+    held = (actions == prev[1:]) & (actions == prev[:-1])
+    held[:3] = False
+    stats = {}
+    for a in range(len(ACTIONS)):
+        for phase, mask in [('first', first), ('held', held)]:
+            m = valid & mask & (actions == a)
+            stats[(a, phase)] = (disp[m].mean() if m.any() else np.nan, turn[m].mean() if m.any() else np.nan)
+    stats['contact'] = contact.mean()
+    stats['near_wall'] = _near_wall(pos[1:], run['layout'], AGENT_RADIUS + 0.05).mean()
+    return stats
+
+
+def _run_real(size: str, seed: int, num_envs: int, actions: Optional[np.ndarray] = None, steps: int = 1000) -> Dict[str, np.ndarray]:
+    """Episodes 0..num_envs-1 of the real env, episode j with the action sequence actions[:, j],
+    or with BatchOraclePolicy if None. Arrays are (steps, num_envs, ...) as of _run_surrogate()."""
+    from memory_maze import SIZES
+    from memory_maze.oracle import BatchOraclePolicy
+    from memory_maze.physics_check import unwrap, wall_contact
+
+    env = SIZES[size](seed=seed, global_observables=True, state_only=True)
+    base = unwrap(env)
+    # Wall contact at any physics substep of the step, as info['wall_contact'] of the surrogate.
+    # At the end of the step alone, the ball bouncing against a wall it pushes into is in contact
+    # only part of the time.
+    touched = []
+    base.add_extra_hook('after_substep', lambda physics, random_state: touched.append(wall_contact(base)))
+    policy = BatchOraclePolicy()
+    episodes = []
+    elapsed = 0.0
+    for j in range(num_envs):
+        obs = env.reset(episode_index=j).observation
+        pos, direction, contact, reward, actions_taken = [obs['agent_pos']], [obs['agent_dir']], [], [], []
+        start = time.perf_counter()
+        for t in range(steps):
+            if actions is not None:
+                action = actions[t, j]
+            else:
+                action = policy(obs['agent_pos'][None], obs['agent_dir'][None], obs['target_pos'][None], obs['maze_layout'][None])[0]
+            touched.clear()
+            ts = env.step(action)
+            obs = ts.observation
+            pos.append(obs['agent_pos'])
+            direction.append(obs['agent_dir'])
+            contact.append(any(touched))
+            reward.append(ts.reward)
+            actions_taken.append(action)
+        elapsed += time.perf_counter() - start
+        episodes.append(dict(pos=pos, dir=direction, contact=contact, reward=reward, action=actions_taken, layout=obs['maze_layout']))
+    env.close()
+    run = {key: np.stack([np.array(episode[key]) for episode in episodes], 1) for key in ['pos', 'dir', 'contact', 'reward', 'action']}
+    return dict(run, layout=np.stack([episode['layout'] for episode in episodes]), time=elapsed)
+
+
+def _run_surrogate(size: str, seed: int, num_envs: int, actions: Optional[np.ndarray] = None, steps: int = 1000) -> Dict[str, np.ndarray]:
+    from memory_maze.oracle import BatchOraclePolicy
+
+    env = SurrogateMaze(size, num_envs, seed)
+    policy = BatchOraclePolicy()
+    obs = env.reset()
+    layout = obs['maze_layout']
+    pos, direction, contact, reward, actions_taken = [obs['agent_pos']], [obs['agent_dir']], [], [], []
+    start = time.perf_counter()
+    for t in range(steps):
+        action = actions[t] if actions is not None else policy(obs['agent_pos'], obs['agent_dir'], obs['target_pos'], obs['maze_layout'])
+        obs, r, done, info = env.step(action)
+        pos.append(obs['agent_pos'])
+        direction.append(obs['agent_dir'])
+        contact.append(info['wall_contact'])
+        reward.append(r)
+        actions_taken.append(action)
+    elapsed = time.perf_counter() - start
+    return dict(pos=np.array(pos), dir=np.array(direction), contact=np.array(contact),
+                reward=np.array(reward), action=np.array(actions_taken), layout=layout, time=elapsed)
+
+
+def calibration_report(size: str = '9x9', seed: int = 0, steps: int = 500, num_envs: int = 10) -> Dict[str, Any]:
+    """Compares motion statistics of the surrogate with the real env, and prints them.
+
+    Both run num_envs episodes of held random actions, with the same action sequence for
+    episode j, and num_envs episodes of BatchOraclePolicy. The real env runs at tens of
+    steps/sec, so the surrogate speed is measured separately on a batch of 1024 envs."""
+    steps = min(steps, SurrogateMaze(size, 1).episode_steps - 1)  # Without the automatic reset at the end
+    rng = np.random.RandomState(seed)
+    actions = _random_actions(rng, steps, num_envs)
+    real = _run_real(size, seed, num_envs, actions, steps)
+    sur = _run_surrogate(size, seed, num_envs, actions, steps)
+    real_stats = _motion_stats(real)
+    sur_stats = _motion_stats(sur)
+    real_oracle = _run_real(size, seed, num_envs, None, steps)
+    sur_oracle = _run_surrogate(size, seed, num_envs, None, steps)
+    sur_batch = _run_surrogate(size, seed, 1024, None, min(steps, 100))
+
+    names = ['noop', 'forward', 'left', 'right', 'forward_left', 'forward_right']
+    print(f'Motion per step under held random actions ({num_envs} episodes x {steps} steps each), in open space:')
+    print(f'{"action":>14} {"phase":>6} {"cells real":>10} {"surrogate":>10} {"deg real":>9} {"surrogate":>10}')
+    for a, name in enumerate(names):
+        for phase in ['first', 'held']:
+            (rd, rt), (sd, st) = real_stats[(a, phase)], sur_stats[(a, phase)]
+            print(f'{name:>14} {phase:>6} {rd:>10.3f} {sd:>10.3f} {rt:>9.1f} {st:>10.1f}')
+    print()
+    report = dict(
+        motion=dict(real=real_stats, surrogate=sur_stats),
+        contact_rate=(real_stats['contact'], sur_stats['contact']),
+        near_wall_rate=(real_stats['near_wall'], sur_stats['near_wall']),
+        oracle_targets_per_100=(real_oracle['reward'].mean() * 100, sur_oracle['reward'].mean() * 100),
+        oracle_contact_rate=(real_oracle['contact'].mean(), sur_oracle['contact'].mean()),
+        steps_per_sec=(real_oracle['reward'].size / real_oracle['time'], sur_batch['reward'].size / sur_batch['time']),
+    )
+    print(f'{"":>34} {"real":>10} {"surrogate":>10}')
+    print(f'{"Wall contact, random actions":>34} {report["contact_rate"][0]:>10.1%} {report["contact_rate"][1]:>10.1%}')
+    print(f'{"Near wall (<0.15), random actions":>34} {report["near_wall_rate"][0]:>10.1%} {report["near_wall_rate"][1]:>10.1%}')
+    print(f'{"Wall contact, oracle policy":>34} {report["oracle_contact_rate"][0]:>10.1%} {report["oracle_contact_rate"][1]:>10.1%}')
+    print(f'{"Targets per 100 steps, oracle":>34} {report["oracle_targets_per_100"][0]:>10.2f} {report["oracle_targets_per_100"][1]:>10.2f}')
+    print(f'{"Steps/sec (oracle, incl. policy)":>34} {report["steps_per_sec"][0]:>10.0f} {report["steps_per_sec"][1]:>10.0f}')
+    print('Wall contact: the ball touches a wall at any time during the step (in any physics substep of the real env).')
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=str, default='9x9', choices=list(MAZE_SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--steps', type=int, default=500, help='Steps per episode')
+    parser.add_argument('--num-envs', type=int, default=10, help='Episodes of each env, for each policy')
+    args = parser.parse_args(argv)
+    calibration_report(args.size, args.seed, args.steps, args.num_envs)
+
+
+if __name__ == '__main__':
+    main()
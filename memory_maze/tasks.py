@@ -1,15 +1,34 @@
 import numpy as np
-from dm_control import composer
 from dm_control.locomotion.arenas import labmaze_textures
 
+from memory_maze.layout_bank import LayoutBank
 from memory_maze.maze import *
-from memory_maze.oracle import DrawMinimapWrapper, PathToTargetWrapper
 from memory_maze.wrappers import *
 
 # Slow control (4Hz), so that agent without HRL has a chance.
 # Native control would be ~20Hz, so this corresponds roughly to action_repeat=5.
 DEFAULT_CONTROL_FREQ = 4.0
 
+# Size => inner maze size, number of targets, time limit (s), and overrides of the maze
+# generator defaults of _memory_maze()
+MAZE_SIZES = {
+    '9x9': (9, 3, 250, {}),
+    '11x11': (11, 4, 500, {}),
+    '13x13': (13, 5, 750, {}),
+    '15x15': (15, 6, 1000, dict(max_rooms=9, room_max_size=3)),
+}
+
+# Discrete action set, as (roll, steer) controls of the walker
+ACTIONS = [
+    np.array([0.0, 0.0]),  # noop
+    np.array([-1.0, 0.0]),  # forward
+    np.array([0.0, -1.0]),  # left
+    np.array([0.0, +1.0]),  # right
+    np.array([-1.0, -1.0]),  # forward + left
+    np.array([-1.0, +1.0]),  # forward + right
+]
+NOOP, FORWARD, LEFT, RIGHT, FORWARD_LEFT, FORWARD_RIGHT = range(len(ACTIONS))
+
 
 def memory_maze_9x9(**kwargs):
     """
@@ -22,15 +41,15 @@ def memory_maze_9x9(**kwargs):
         roomMinSize = 3,
     }
     """
-    return _memory_maze(9, 3, 250, **kwargs)
+    return _sized_memory_maze('9x9', **kwargs)
 
 
 def memory_maze_11x11(**kwargs):
-    return _memory_maze(11, 4, 500, **kwargs)
+    return _sized_memory_maze('11x11', **kwargs)
 
 
 def memory_maze_13x13(**kwargs):
-    return _memory_maze(13, 5, 750, **kwargs)
+    return _sized_memory_maze('13x13', **kwargs)
 
 
 def memory_maze_15x15(**kwargs):
@@ -44,7 +63,12 @@ def memory_maze_15x15(**kwargs):
         roomMaxSize = 3,
     }
     """
-    return _memory_maze(15, 6, 1000, max_rooms=9, room_max_size=3, **kwargs)
+    return _sized_memory_maze('15x15', **kwargs)
+
+
+def _sized_memory_maze(size, **kwargs):
+    maze_size, n_targets, time_limit, maze_kwargs = MAZE_SIZES[size]
+    return _memory_maze(maze_size, n_targets, time_limit, **dict(maze_kwargs, **kwargs))
 
 
 def _memory_maze(
@@ -65,8 +89,30 @@ def _memory_maze(
     camera_resolution=64,
     seed=None,
     randomize_colors=False,
+    layout_bank=None,
+    fast_reset=False,
+    fused_observations=False,
+    action_repeat=1,
+    state_only=False,
+    physics_profile='default',
 ):
+    if layout_bank is not None and not isinstance(layout_bank, LayoutBank):
+        layout_bank = LayoutBank(layout_bank)
+    if layout_bank is not None and layout_bank.min_targets < n_targets:
+        raise ValueError(f'Layout bank has layouts with only {layout_bank.min_targets} target positions, {n_targets} required')
+    if state_only and (image_only_obs or show_path or not global_observables):
+        raise ValueError('state_only requires global_observables, and is not supported with image_only_obs or show_path')
+    if physics_profile not in PHYSICS_PROFILES:
+        raise ValueError(f'Unknown physics_profile {physics_profile!r}, expected one of {list(PHYSICS_PROFILES)}')
+    if fast_reset and randomize_colors:
+        raise ValueError('fast_reset is not supported with randomize_colors, because targets are recreated every episode')
+    if action_repeat < 1:
+        raise ValueError('action_repeat must be >= 1')
+
     random_state = np.random.RandomState(seed)
+    # One texture set shared by all wall variations, so its textures are in the model only once
+    # (ten copies would add ~250MB of texture data to compile and upload to the renderer).
+    variation_textures = labmaze_textures.WallTextures('style_01')
     walker = RollingBallWithFriction(camera_height=0.3, add_ears=top_camera)
     arena = MazeWithTargetsArena(
         x_cells=maze_size + 2,  # inner size => outer size
@@ -81,10 +127,12 @@ def _memory_maze(
         floor_textures=FixedFloorTexture('style_01', ['blue', 'blue_bright']),
         wall_textures=dict({
             '*': FixedWallTexture('style_01', 'yellow'),  # default wall
-        }, **{str(i): labmaze_textures.WallTextures('style_01') for i in range(10)}  # variations
+        }, **{str(i): variation_textures for i in range(10)}  # variations
         ),
         skybox_texture=None,
         random_seed=random_state.randint(2147483648),
+        layout_bank=layout_bank,
+        fast_reset=fast_reset,
     )
 
     task = MemoryMazeTask(
@@ -93,29 +141,22 @@ def _memory_maze(
         n_targets=n_targets,
         target_radius=0.6,
         target_height_above_ground=0.5 if good_visibility else -0.6,
-        enable_global_task_observables=True,  # Always add to underlying env, but not always expose in RemapObservationWrapper
+        enable_global_task_observables=True,  # Created always, but disabled below unless exposed in obs_mapping
+        physics_timestep=PHYSICS_PROFILES[physics_profile]['timestep'],
         control_timestep=1.0 / control_freq,
         camera_resolution=camera_resolution,
         target_randomize_colors=randomize_colors,
     )
 
-    if top_camera:
-        task.observables['top_camera'].enabled = True
-
-    env = composer.Environment(
-        time_limit=time_limit - 1e-3,  # subtract epsilon to make sure ep_length=time_limit*fps
-        task=task,
-        random_state=random_state,
-        strip_singleton_obs_buffer_dim=True)
-
     obs_mapping = {
         'image': 'walker/egocentric_camera' if not top_camera else 'top_camera',
         'target_color': 'target_color',
     }
+    if state_only:
+        # No image in observations, so cameras are disabled and nothing is rendered
+        del obs_mapping['image']
+        target_color_in_image = False
     if global_observables:
-        env = TargetsPositionWrapper(env, task._maze_arena.xy_scale, task._maze_arena.maze.width, task._maze_arena.maze.height)
-        env = AgentPositionWrapper(env, task._maze_arena.xy_scale, task._maze_arena.maze.width, task._maze_arena.maze.height)
-        env = MazeLayoutWrapper(env)
         obs_mapping = dict(obs_mapping, **{
             'agent_pos': 'agent_pos',
             'agent_dir': 'agent_dir',
@@ -126,27 +167,78 @@ def _memory_maze(
             'maze_layout': 'maze_layout',
         })
 
-    env = RemapObservationWrapper(env, obs_mapping)
+    arena.mjcf_model.option.set_attributes(**PHYSICS_PROFILES[physics_profile]['options'])
+
+    # Only evaluate dm_control observables needed for the exposed observations
+    _enable_observables(task, _source_observables(obs_mapping, n_targets))
+
+    env = MemoryMazeEnvironment(
+        time_limit=time_limit - 1e-3,  # subtract epsilon to make sure ep_length=time_limit*fps
+        task=task,
+        random_state=random_state,
+        strip_singleton_obs_buffer_dim=True,
+        recompile_mjcf_every_episode=not fast_reset,
+        action_repeat=action_repeat,
+        seed=seed)
+
+    if image_only_obs:
+        assert target_color_in_image, 'Image-only observation only makes sense with target_color_in_image'
 
-    if target_color_in_image:
-        env = TargetColorAsBorderWrapper(env)
+    maze_args = (task._maze_arena.xy_scale, task._maze_arena.maze.width, task._maze_arena.maze.height)
+    if fused_observations:
+        env = FusedObservationWrapper(
+            env,
+            obs_mapping,
+            *maze_args,
+            target_color_in_image=target_color_in_image,
+            image_only_key='image' if image_only_obs and not show_path else None)
+    else:
+        if global_observables:
+            env = TargetsPositionWrapper(env, *maze_args)
+            env = AgentPositionWrapper(env, *maze_args)
+            env = MazeLayoutWrapper(env)
+
+        env = RemapObservationWrapper(env, obs_mapping)
+
+        if target_color_in_image:
+            env = TargetColorAsBorderWrapper(env)
 
     if show_path:
+        from memory_maze.oracle import DrawMinimapWrapper, PathToTargetWrapper  # oracle imports the action ids from here
         env = PathToTargetWrapper(env)
         env = DrawMinimapWrapper(env)
 
-    if image_only_obs:
-        assert target_color_in_image, 'Image-only observation only makes sense with target_color_in_image'
+    if image_only_obs and (show_path or not fused_observations):
         env = ImageOnlyObservationWrapper(env)
 
     if discrete_actions:
-        env = DiscreteActionSetWrapper(env, [
-            np.array([0.0, 0.0]),  # noop
-            np.array([-1.0, 0.0]),  # forward
-            np.array([0.0, -1.0]),  # left
-            np.array([0.0, +1.0]),  # right
-            np.array([-1.0, -1.0]),  # forward + left
-            np.array([-1.0, +1.0]),  # forward + right
-        ])
+        env = DiscreteActionSetWrapper(env, ACTIONS)
 
     return env
+
+
+def _source_observables(obs_mapping, n_targets):
+    """Underlying dm_control observables, from which the obs_mapping keys are computed by the wrappers."""
+    targets = ['target_index'] + [f'walker/target_{kind}_{i}' for i in range(n_targets) for kind in ['rel', 'abs']]
+    derived = {
+        # TargetsPositionWrapper
+        'targets_vec': targets,
+        'targets_pos': targets,
+        'target_vec': targets,
+        'target_pos': targets,
+        # AgentPositionWrapper
+        'agent_pos': ['absolute_position'],
+        'agent_dir': ['absolute_orientation'],
+    }
+    keys = set()
+    for key in obs_mapping.values():
+        keys.update(derived.get(key, [key]))
+    return keys
+
+
+def _enable_observables(task, keys):
+    observables = task.observables
+    missing = set(keys) - set(observables)
+    assert not missing, f'Missing observables: {missing}'
+    for key, observable in observables.items():
+        observable.enabled = key in keys
@@ -0,0 +1,363 @@
+"""Batched environments in worker processes, with observations in shared memory.
+
+MemoryMazeVecEnv steps all envs together: reset() and step(actions) return (num_envs, ...)
+arrays once every env is done. Use it for synchronous training loops:
+
+    env = make_vec_env(tasks.memory_maze_9x9, num_envs=16, seed=0)
+    obs = env.reset()
+    obs, reward, done, info = env.step(actions)
+
+MemoryMazeEnvPool steps only the envs it is sent actions for, and recv() returns as soon as
+min_batch of them are done, so that slow resets don't stall the whole batch. Use it for
+actor-learner setups (send/recv), or for per-env actors in asyncio (areset/astep).
+"""
+import asyncio
+import functools
+import multiprocessing as mp
+import time
+import traceback
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import dm_env
+import numpy as np
+from dm_env import specs
+
+_ALIGN = 64
+
+
+class MemoryMazeVecEnv:
+    """Steps a batch of environments in worker processes.
+
+    Each worker writes its observations straight into preallocated shared-memory
+    arrays, so step results are returned as batched (N, ...) arrays without pickling
+    images through pipes. Finished episodes are reset automatically, so the
+    observation returned for a finished env is the first observation of its next episode.
+    With final_observations=True, the last observation of the finished episode is also kept,
+    and returned in info['final_observation'].
+    """
+
+    def __init__(self, env_fns: Sequence[Callable[[], dm_env.Environment]], context: str = 'spawn', final_observations: bool = False):
+        self.num_envs = len(env_fns)
+        self._final_observations = final_observations
+        ctx = mp.get_context(context)
+        self._conns = []
+        self._procs = []
+        self._shm = None  # Created after the workers report their specs
+        for i, env_fn in enumerate(env_fns):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker, args=(child_conn, env_fn, i), daemon=True)
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+        self._closed = False
+
+        env_specs = [self._recv(conn) for conn in self._conns]
+        self._observation_spec, self._action_spec = env_specs[0]
+        self._single_obs = not isinstance(self._observation_spec, dict)
+        obs_spec = {None: self._observation_spec} if self._single_obs else self._observation_spec
+
+        layout = _make_layout(self.num_envs, obs_spec, self._action_spec, final_observations)
+        size = max(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize for _, _, shape, dtype, offset in layout)
+        self._shm = SharedMemory(create=True, size=size)
+        self._obs, self._final_obs, self._buffers = _make_views(self._shm, layout)
+        for conn in self._conns:
+            conn.send(('attach', (self._shm.name, layout)))
+        for conn in self._conns:
+            self._recv(conn)
+
+    def observation_spec(self) -> Any:
+        """Observation spec of a single environment."""
+        return self._observation_spec
+
+    def action_spec(self) -> Any:
+        """Action spec of a single environment."""
+        return self._action_spec
+
+    def reset(self, copy: bool = True, **kwargs: Optional[Sequence[Any]]) -> Any:
+        """Resets all environments. Keyword arguments are sequences of per-env values
+        of the env reset() arguments, e.g. episode_index=[0, 1, 2, 3]."""
+        env_kwargs = [{key: values[i] for key, values in kwargs.items() if values is not None} for i in range(self.num_envs)]
+        self._send_all('reset', env_kwargs)
+        return self._observation(copy)
+
+    def step(self, actions, copy: bool = True) -> Tuple[Any, np.ndarray, np.ndarray, dict]:
+        self._buffers['action'][:] = actions
+        self._send_all('step')
+        done = self._buffers['done'].copy()
+        info = {'TimeLimit.truncated': done & (self._buffers['discount'] != 0.0)}
+        if self._final_observations:
+            info['final_observation'] = self._observation(copy, self._final_obs)
+        return self._observation(copy), self._buffers['reward'].copy(), done, info
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for conn in self._conns:
+            try:
+                conn.send(('close', None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self._obs = self._buffers = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                pass  # Observations returned with copy=False are still referenced
+            self._shm.unlink()
+
+    def __del__(self):
+        if not getattr(self, '_closed', True):
+            self.close()
+
+    def _send_all(self, cmd, payloads: Optional[Sequence[Any]] = None):
+        for i, conn in enumerate(self._conns):
+            conn.send((cmd, payloads[i] if payloads is not None else None))
+        for conn in self._conns:
+            self._recv(conn)
+
+    def _recv(self, conn):
+        msg, payload = conn.recv()
+        if msg == 'error':
+            self.close()
+            raise RuntimeError(f'Worker process failed:\n{payload}')
+        return payload
+
+    def _observation(self, copy, buffers=None):
+        obs = {key: value.copy() if copy else value for key, value in (buffers if buffers is not None else self._obs).items()}
+        return obs[None] if self._single_obs else obs
+
+
+class MemoryMazeEnvPool(MemoryMazeVecEnv):
+    """Asynchronous pool: steps only the given envs, and returns whichever finish first.
+
+    Resets (and the automatic reset at the end of an episode) are much slower than steps,
+    so instead of waiting for the whole batch, send() dispatches actions to some envs and
+    recv() returns as soon as at least min_batch of the pending envs are done, together with
+    their ids in info['env_id']. Stragglers keep running and are returned by a later recv().
+
+        pool.async_reset()
+        while True:
+            obs, reward, done, info = pool.recv(min_batch=8)
+            pool.send(policy(obs), info['env_id'])
+
+    For actor loops in a single process, astep() and areset() are coroutines for one env,
+    which wait on the worker pipe without blocking the event loop:
+
+        async def actor(i):
+            obs = await pool.areset(i)
+            while True:
+                obs, reward, done, info = await pool.astep(i, policy(obs))
+
+        await asyncio.gather(*(actor(i) for i in range(pool.num_envs)))
+
+    Don't mix the two interfaces for the same env. The synchronous reset() and step()
+    of MemoryMazeVecEnv still work when no env is pending.
+    """
+
+    def __init__(self, env_fns: Sequence[Callable[[], dm_env.Environment]], context: str = 'spawn', final_observations: bool = False):
+        super().__init__(env_fns, context, final_observations)
+        self._conn_ids = {conn: i for i, conn in enumerate(self._conns)}
+        self._pending = set()
+
+    def async_reset(self, env_ids: Optional[Sequence[int]] = None, **kwargs: Optional[Sequence[Any]]):
+        """Starts resetting the envs (all by default). Keyword arguments are per-env sequences, as in reset()."""
+        env_ids = range(self.num_envs) if env_ids is None else env_ids
+        for j, i in enumerate(env_ids):
+            self._send(i, 'reset', {key: values[j] for key, values in kwargs.items() if values is not None})
+
+    def send(self, actions, env_ids: Sequence[int]):
+        """Starts stepping the envs env_ids with actions[j] for env_ids[j]."""
+        env_ids = np.asarray(env_ids, int)
+        self._check_idle(env_ids.tolist())
+        self._buffers['action'][env_ids] = actions
+        for i in env_ids:
+            self._send(int(i), 'step')
+
+    def recv(self, min_batch: Optional[int] = None, timeout: Optional[float] = None) -> Tuple[Any, np.ndarray, np.ndarray, dict]:
+        """Waits until at least min_batch pending envs are done (all pending by default) and returns
+        the results of all that are done, in the order they finished. With a timeout, may return fewer."""
+        min_batch = len(self._pending) if min_batch is None else min(min_batch, len(self._pending))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        env_ids = []
+        while self._pending:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            ready = wait([self._conns[i] for i in self._pending], 0.0 if len(env_ids) >= min_batch else remaining)
+            if not ready:
+                break
+            for conn in ready:
+                env_ids.append(self._finish(self._conn_ids[conn]))
+        return self._results(env_ids)
+
+    async def areset(self, env_id: int, **kwargs) -> Any:
+        """Resets one env, returning its first observation."""
+        self._send(env_id, 'reset', kwargs)
+        await self._readable(env_id)
+        obs, _, _, _ = self._results([self._finish(env_id)])
+        return _unbatch(obs)
+
+    async def astep(self, env_id: int, action) -> Tuple[Any, float, bool, dict]:
+        """Steps one env. Finished episodes are reset automatically, as in step()."""
+        self._check_idle([env_id])
+        self._buffers['action'][env_id] = action
+        self._send(env_id, 'step')
+        await self._readable(env_id)
+        obs, reward, done, info = self._results([self._finish(env_id)])
+        return _unbatch(obs), float(reward[0]), bool(done[0]), _unbatch(info)
+
+    @property
+    def pending(self) -> List[int]:
+        """Envs that were sent a command and not yet received."""
+        return sorted(self._pending)
+
+    def step(self, actions, copy: bool = True) -> Tuple[Any, np.ndarray, np.ndarray, dict]:
+        self._check_idle(range(self.num_envs))
+        return super().step(actions, copy)
+
+    def _check_idle(self, env_ids: Iterable[int]):
+        # Checked before the action buffer is written, which a pending env may still be reading
+        pending = sorted(self._pending.intersection(env_ids))
+        if pending:
+            raise RuntimeError(f'Envs {pending} are still pending, recv() them first')
+
+    def _send(self, env_id: int, cmd: str, payload: Any = None):
+        self._check_idle([env_id])
+        self._pending.add(env_id)
+        self._conns[env_id].send((cmd, payload))
+
+    def _finish(self, env_id: int) -> int:
+        self._recv(self._conns[env_id])
+        self._pending.remove(env_id)
+        return env_id
+
+    def _send_all(self, cmd, payloads: Optional[Sequence[Any]] = None):
+        self._check_idle(range(self.num_envs))
+        super()._send_all(cmd, payloads)
+
+    def _results(self, env_ids: List[int]) -> Tuple[Any, np.ndarray, np.ndarray, dict]:
+        ids = np.array(env_ids, int)
+        done = self._buffers['done'][ids]
+        info = {'env_id': ids, 'TimeLimit.truncated': done & (self._buffers['discount'][ids] != 0.0)}
+        if self._final_observations:
+            info['final_observation'] = self._observation(False, {key: value[ids] for key, value in self._final_obs.items()})
+        obs = self._observation(False, {key: value[ids] for key, value in self._obs.items()})  # Fancy indexing copies
+        return obs, self._buffers['reward'][ids], done, info
+
+    async def _readable(self, env_id: int):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = self._conns[env_id].fileno()
+        loop.add_reader(fd, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            loop.remove_reader(fd)
+
+
+def make_vec_env(task: Callable[..., dm_env.Environment], num_envs: int, seed: Optional[int] = None, **kwargs) -> MemoryMazeVecEnv:
+    """Creates MemoryMazeVecEnv from a task constructor, e.g. tasks.memory_maze_9x9."""
+    env_fns = [functools.partial(task, seed=None if seed is None else seed + i, **kwargs) for i in range(num_envs)]
+    return MemoryMazeVecEnv(env_fns)
+
+
+def make_env_pool(task: Callable[..., dm_env.Environment], num_envs: int, seed: Optional[int] = None, **kwargs) -> MemoryMazeEnvPool:
+    """Creates MemoryMazeEnvPool from a task constructor, e.g. memory_maze.SIZES['9x9']."""
+    env_fns = [functools.partial(task, seed=None if seed is None else seed + i, **kwargs) for i in range(num_envs)]
+    return MemoryMazeEnvPool(env_fns)
+
+
+def _unbatch(data: Any) -> Any:
+    if isinstance(data, dict):
+        return {key: value[0] for key, value in data.items()}
+    return data[0]
+
+
+def _make_layout(num_envs, obs_spec: Dict[Any, specs.Array], action_spec: specs.Array, final_observations: bool = False) -> List[tuple]:
+    if isinstance(action_spec, specs.DiscreteArray):
+        action_shape, action_dtype = (), np.int64
+    else:
+        action_shape, action_dtype = action_spec.shape, action_spec.dtype
+    arrays = [('obs', key, spec.shape, spec.dtype) for key, spec in obs_spec.items()]
+    if final_observations:
+        arrays += [('final', key, spec.shape, spec.dtype) for key, spec in obs_spec.items()]
+    arrays += [
+        ('buffer', 'action', action_shape, action_dtype),
+        ('buffer', 'reward', (), np.float64),
+        ('buffer', 'discount', (), np.float64),
+        ('buffer', 'done', (), np.bool_),
+    ]
+    layout = []
+    offset = 0
+    for group, key, shape, dtype in arrays:
+        shape = (num_envs,) + tuple(shape)
+        dtype = np.dtype(dtype).str
+        layout.append((group, key, shape, dtype, offset))
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += (nbytes + _ALIGN - 1) // _ALIGN * _ALIGN
+    return layout
+
+
+def _make_views(shm: SharedMemory, layout: List[tuple]) -> Tuple[Dict[Any, np.ndarray], Dict[Any, np.ndarray], Dict[str, np.ndarray]]:
+    views = {'obs': {}, 'final': {}, 'buffer': {}}
+    for group, key, shape, dtype, offset in layout:
+        views[group][key] = np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+    return views['obs'], views['final'], views['buffer']
+
+
+def _write_observation(obs_buffers, index, observation):
+    if None in obs_buffers:
+        observation = {None: observation}
+    for key, buffer in obs_buffers.items():
+        buffer[index] = observation[key]
+
+
+def _worker(conn, env_fn, index):
+    env = None
+    shm = None
+    try:
+        env = env_fn()
+        conn.send(('spec', (env.observation_spec(), env.action_spec())))
+        _, (shm_name, layout) = conn.recv()
+        shm = SharedMemory(name=shm_name)
+        obs_buffers, final_buffers, buffers = _make_views(shm, layout)
+        conn.send(('ok', None))
+        while True:
+            cmd, payload = conn.recv()
+            if cmd == 'reset':
+                ts = env.reset(**(payload or {}))
+                buffers['reward'][index] = 0.0
+                buffers['discount'][index] = 1.0
+                buffers['done'][index] = False
+            elif cmd == 'step':
+                ts = env.step(buffers['action'][index])
+                buffers['reward'][index] = ts.reward
+                buffers['discount'][index] = ts.discount
+                buffers['done'][index] = ts.last()
+                if ts.last():
+                    if final_buffers:
+                        _write_observation(final_buffers, index, ts.observation)
+                    ts = env.reset()  # Auto-reset, returning the first observation of the next episode
+            elif cmd == 'close':
+                break
+            else:
+                raise ValueError(f'Unknown command: {cmd}')
+            _write_observation(obs_buffers, index, ts.observation)
+            conn.send(('ok', None))
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        obs_buffers = final_buffers = buffers = None
+        if shm is not None:
+            shm.close()
+        if env is not None:
+            env.close()
+        conn.close()
@@ -21,8 +21,8 @@ class Wrapper(dm_env.Environment):
     def step(self, action) -> dm_env.TimeStep:
         return self.env.step(action)
 
-    def reset(self) -> dm_env.TimeStep:
-        return self.env.reset()
+    def reset(self, **kwargs) -> dm_env.TimeStep:
+        return self.env.reset(**kwargs)
 
     def action_spec(self) -> Any:
         return self.env.action_spec()
@@ -39,6 +39,12 @@ class Wrapper(dm_env.Environment):
     def close(self):
         return self.env.close()
 
+    def snapshot(self) -> bytes:
+        return self.env.snapshot()
+
+    def restore(self, snapshot: bytes):
+        self.env.restore(snapshot)
+
 
 class ObservationWrapper(Wrapper):
     """Base class for observation wrapper."""
@@ -53,8 +59,8 @@ class ObservationWrapper(Wrapper):
         step_type, discount, reward, observation = self.env.step(action)
         return dm_env.TimeStep(step_type, discount, reward, self.observation(observation))
 
-    def reset(self) -> dm_env.TimeStep:
-        step_type, discount, reward, observation = self.env.reset()
+    def reset(self, **kwargs) -> dm_env.TimeStep:
+        step_type, discount, reward, observation = self.env.reset(**kwargs)
         return dm_env.TimeStep(step_type, discount, reward, self.observation(observation))
 
 
@@ -157,7 +163,15 @@ class AgentPositionWrapper(ObservationWrapper):
 
 
 class MazeLayoutWrapper(ObservationWrapper):
-    """Postprocesses maze_layout observation."""
+    """Postprocesses maze_layout observation.
+
+    The layout is fixed within an episode, so it is processed once on reset, and the same
+    read-only array is returned on every step.
+    """
+
+    def __init__(self, env: dm_env.Environment):
+        super().__init__(env)
+        self._layout = None
 
     def observation_spec(self):
         spec = self.env.observation_spec()
@@ -168,16 +182,37 @@ class MazeLayoutWrapper(ObservationWrapper):
         spec['maze_layout'] = specs.BoundedArray((n - 2, m - 2), np.uint8, 0, 1, 'maze_layout')
         return spec
 
+    def reset(self, **kwargs) -> dm_env.TimeStep:
+        self._layout = None
+        return super().reset(**kwargs)
+
+    def restore(self, snapshot: bytes):
+        self._layout = None  # Snapshot may be from another episode
+        super().restore(snapshot)
+
+    def step(self, action) -> dm_env.TimeStep:
+        step_type, discount, reward, observation = self.env.step(action)
+        if step_type.first():
+            self._layout = None  # Underlying env was auto-reset
+        return dm_env.TimeStep(step_type, discount, reward, self.observation(observation))
+
     def observation(self, obs):
         assert isinstance(obs, dict)
-        maze = obs['maze_layout']
-        maze = maze[1:-1, 1:-1]  # Remove outer walls
-        maze = np.flip(maze, 0)  # Flip vertical axis so that bottom-left is at maze[0,0]
-        nonwalls = (maze == ' ') | (maze == 'P') | (maze == 'G')
-        obs['maze_layout'] = nonwalls.astype(np.uint8)
+        if self._layout is None:
+            self._layout = _process_layout(obs['maze_layout'])
+        obs['maze_layout'] = self._layout
         return obs
 
 
+def _process_layout(maze: np.ndarray) -> np.ndarray:
+    maze = maze[1:-1, 1:-1]  # Remove outer walls
+    maze = np.flip(maze, 0)  # Flip vertical axis so that bottom-left is at maze[0,0]
+    nonwalls = (maze == ' ') | (maze == 'P') | (maze == 'G')
+    layout = nonwalls.astype(np.uint8)
+    layout.flags.writeable = False  # Shared by all steps of the episode
+    return layout
+
+
 class ImageOnlyObservationWrapper(ObservationWrapper):
     """Select one of the dictionary observation keys as observation."""
 
@@ -229,3 +264,115 @@ class TargetColorAsBorderWrapper(ObservationWrapper):
         img[:B, :] = target_color * 255 * 0.7
         img[-B:, :] = target_color * 255 * 0.7
         return obs
+
+
+class FusedObservationWrapper(ObservationWrapper):
+    """Single-pass equivalent of the TargetsPositionWrapper, AgentPositionWrapper, MazeLayoutWrapper,
+    RemapObservationWrapper, TargetColorAsBorderWrapper and ImageOnlyObservationWrapper stack.
+
+    Only the keys in obs_mapping are computed, and no intermediate dicts or TimeSteps are created.
+    Outputs are identical to the unfused stack.
+    """
+
+    TARGETS_KEYS = ('targets_vec', 'targets_pos', 'target_vec', 'target_pos')
+    AGENT_KEYS = ('agent_pos', 'agent_dir')
+    LAYOUT_KEYS = ('maze_layout',)
+
+    def __init__(
+        self,
+        env: dm_env.Environment,
+        mapping: Dict[str, str],
+        maze_xy_scale=None,
+        maze_width=None,
+        maze_height=None,
+        target_color_in_image=False,
+        image_only_key=None,
+    ):
+        super().__init__(env)
+        self.mapping = mapping
+        self.target_color_in_image = target_color_in_image
+        self.image_only_key = image_only_key
+        sources = set(mapping.values())
+        self._targets = any(key in sources for key in self.TARGETS_KEYS)
+        self._agent = any(key in sources for key in self.AGENT_KEYS)
+        self._maze = any(key in sources for key in self.LAYOUT_KEYS)
+        if self._targets or self._agent:
+            self.maze_xy_scale = maze_xy_scale
+            self.center_ji = np.array([maze_width - 2.0, maze_height - 2.0]) / 2.0
+
+        spec = self.env.observation_spec()
+        assert isinstance(spec, dict)
+        self.n_targets = 0
+        while f'walker/target_rel_{self.n_targets}' in spec:
+            self.n_targets += 1
+        self._target_rel_keys = [f'walker/target_rel_{i}' for i in range(self.n_targets)]
+        self._target_abs_keys = [f'walker/target_abs_{i}' for i in range(self.n_targets)]
+        self._layout = None
+
+    def observation_spec(self):
+        spec = self.env.observation_spec()
+        assert isinstance(spec, dict)
+        if self._targets:
+            assert self.n_targets > 0 and 'target_index' in spec
+            spec['targets_vec'] = specs.Array((self.n_targets, 2), float, 'targets_vec')
+            spec['targets_pos'] = specs.Array((self.n_targets, 2), float, 'targets_pos')
+            spec['target_vec'] = specs.Array((2,), float, 'target_vec')
+            spec['target_pos'] = specs.Array((2,), float, 'target_pos')
+        if self._agent:
+            assert 'absolute_position' in spec and 'absolute_orientation' in spec
+            spec['agent_pos'] = specs.Array((2, ), float, 'agent_pos')
+            spec['agent_dir'] = specs.Array((2, ), float, 'agent_dir')
+        if self._maze:
+            n, m = spec['maze_layout'].shape
+            spec['maze_layout'] = specs.BoundedArray((n - 2, m - 2), np.uint8, 0, 1, 'maze_layout')
+        spec = {key: spec[key_orig] for key, key_orig in self.mapping.items()}
+        if self.target_color_in_image:
+            assert 'target_color' in spec and 'image' in spec
+        if self.image_only_key is not None:
+            return spec[self.image_only_key]
+        return spec
+
+    def reset(self, **kwargs) -> dm_env.TimeStep:
+        self._layout = None
+        return super().reset(**kwargs)
+
+    def restore(self, snapshot: bytes):
+        self._layout = None  # Snapshot may be from another episode
+        super().restore(snapshot)
+
+    def step(self, action) -> dm_env.TimeStep:
+        step_type, discount, reward, observation = self.env.step(action)
+        if step_type.first():
+            self._layout = None  # Underlying env was auto-reset
+        return dm_env.TimeStep(step_type, discount, reward, self.observation(observation))
+
+    def observation(self, obs):
+        assert isinstance(obs, dict)
+        if self._targets:
+            x_rel = np.array([obs[key][:2] for key in self._target_rel_keys]) / self.maze_xy_scale
+            x_abs = np.array([obs[key][:2] for key in self._target_abs_keys]) / self.maze_xy_scale + self.center_ji
+            target_ix = int(obs['target_index'])
+            obs['targets_vec'] = x_rel
+            obs['targets_pos'] = x_abs
+            obs['target_vec'] = x_rel[target_ix]
+            obs['target_pos'] = x_abs[target_ix]
+        if self._agent:
+            obs['agent_pos'] = obs['absolute_position'][:2] / self.maze_xy_scale + self.center_ji
+            obs['agent_dir'] = obs['absolute_orientation'][:2, 1]
+        if self._maze:
+            if self._layout is None:
+                self._layout = _process_layout(obs['maze_layout'])
+            obs['maze_layout'] = self._layout
+
+        if self.target_color_in_image:
+            img = obs[self.mapping['image']]
+            B = int(2 * np.sqrt(img.shape[0] // 64))
+            color = obs[self.mapping['target_color']] * 255 * 0.7
+            img[:, :B] = color
+            img[:, -B:] = color
+            img[:B, :] = color
+            img[-B:, :] = color
+
+        if self.image_only_key is not None:
+            return obs[self.mapping[self.image_only_key]]
+        return {key: obs[key_orig] for key, key_orig in self.mapping.items()}
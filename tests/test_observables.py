@@ -0,0 +1,23 @@
+from memory_maze import tasks
+from memory_maze.physics_check import unwrap
+
+
+def test_standard_computes_only_exposed_observables():
+    env = tasks.memory_maze_9x9(image_only_obs=True)
+    assert set(unwrap(env).observation_spec()) == {'walker/egocentric_camera', 'target_color'}
+
+
+def test_global_observables_computes_target_sources():
+    env = tasks.memory_maze_9x9(global_observables=True)
+    targets = {f'walker/target_{kind}_{i}' for i in range(3) for kind in ['rel', 'abs']}
+    assert set(unwrap(env).observation_spec()) == {
+        'walker/egocentric_camera',
+        'target_color',
+        'target_index',
+        'absolute_position',
+        'absolute_orientation',
+        'maze_layout',
+    } | targets
+    assert set(env.observation_spec()) == {
+        'image', 'target_color', 'agent_pos', 'agent_dir', 'targets_vec', 'targets_pos', 'target_vec', 'target_pos', 'maze_layout',
+    }